@@ -0,0 +1,321 @@
+import argparse
+import json
+import time
+
+from dsdv_engine import create_engine, add_engine_arguments, get_engine_kwargs
+from dsdv_routing import NO_ROUTE, INVALID_METRIC
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Whole network route quality against the ground truth of dsdv_convergence,
+# which node hears which at its tx_range. The all-pairs hop counts are one
+# BFS per node, run 64 sources at a time as bitsets, and are kept until a
+# link appears or disappears, moves that keep the links do not invalidate
+# them. A ConvergenceChecker can share the cache. The routing tables are read
+# into node x destination matrices and every entry is classified:
+#   missing     destination reachable, no valid route
+#   stale       valid route to an unreachable destination, to a next hop
+#               that is no neighbour or with a metric below the hop count
+#   suboptimal  otherwise valid, metric above the hop count
+#   looping     following the next hops (dead ends and stale next hops
+#               drop the packet) never reaches the destination
+# An entry is correct exactly when dsdv_convergence.is_route_correct holds.
+
+SOURCES_PER_BFS = 64
+ROWS_PER_BLOCK = 256
+COLUMNS_PER_BLOCK = 1024
+
+def get_index_dtype(num_nodes):
+    # smallest signed type for node indices, -1 marks no next hop
+    return np.int16 if num_nodes < 2**15 else np.int32
+
+def get_distance_dtype(num_nodes):
+    # smallest unsigned type for hop counts, its maximum marks unreachable
+    return np.uint16 if num_nodes < 2**16-1 else np.uint32
+
+def spread_bits(values):
+    # bit i of a 16 bit value moves to bit 2*i
+    values = values.astype(np.uint64) & 0xFFFF
+    for shift,mask in ((8,0x00FF00FF),(4,0x0F0F0F0F),(2,0x33333333),(1,0x55555555)):
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+def get_locality_order(xs, ys):
+    # indices sorted along a Z-order curve, nearby nodes end up next to each
+    # other and the BFS of consecutive sources overlap
+    xs = np.asarray(xs,dtype=float)
+    ys = np.asarray(ys,dtype=float)
+    if len(xs) == 0:
+        return np.zeros(0,dtype=np.intp)
+    scale = 65535/max(np.ptp(xs),np.ptp(ys),1e-9)
+    keys = spread_bits((xs-xs.min())*scale) | (spread_bits((ys-ys.min())*scale) << np.uint64(1))
+    return np.argsort(keys,kind="stable")
+
+def all_pairs_hop_counts(num_nodes, n1s, n2s, directed=False):
+    # n1s, n2s: node indices of the undirected edges, or with directed of
+    # the edges n1 -> n2 only, column j then holds the hop counts from node
+    # j. Sources are processed in index order, numbering nearby nodes
+    # consecutively keeps the BFS frontiers small
+    dtype = get_distance_dtype(num_nodes)
+    unreachable = np.iinfo(dtype).max
+    distances = np.full((num_nodes,num_nodes),unreachable,dtype=dtype)
+    if directed:
+        heads = np.asarray(n1s,dtype=np.intp)
+        tails = np.asarray(n2s,dtype=np.intp)
+    else:
+        heads = np.concatenate((n1s,n2s)).astype(np.intp)
+        tails = np.concatenate((n2s,n1s)).astype(np.intp)
+    order = np.argsort(heads,kind="stable")
+    tails = tails[order]
+    offsets = np.zeros(num_nodes+1,dtype=np.intp)
+    np.cumsum(np.bincount(heads,minlength=num_nodes),out=offsets[1:])
+    bits = np.left_shift(np.uint64(1),np.arange(SOURCES_PER_BFS,dtype=np.uint64))
+
+    for start in range(0,num_nodes,SOURCES_PER_BFS):
+        # frontier[k] has bit b set when source start+b reached node
+        # frontier_ids[k] in the last level
+        frontier_ids = np.arange(start,min(start+SOURCES_PER_BFS,num_nodes))
+        source_bits = bits[:len(frontier_ids)]
+        frontier = source_bits.copy()
+        visited = np.zeros(num_nodes,dtype=np.uint64)
+        visited[frontier_ids] = frontier
+        # the sources' columns are filled in a small row major block first
+        columns = np.full((num_nodes,len(frontier_ids)),unreachable,dtype=dtype)
+        columns[frontier_ids,frontier_ids-start] = 0
+        level = 0
+        while len(frontier_ids):
+            level += 1
+            counts = offsets[frontier_ids+1]-offsets[frontier_ids]
+            total = int(counts.sum())
+            if total == 0:
+                break
+            # positions of the frontier's edges in tails
+            firsts = np.repeat(offsets[frontier_ids]-np.cumsum(counts)+counts,counts)
+            targets = tails[firsts+np.arange(total)]
+            reached = np.zeros(num_nodes,dtype=np.uint64)
+            np.bitwise_or.at(reached,targets,np.repeat(frontier,counts))
+            reached &= ~visited
+            frontier_ids = np.flatnonzero(reached)
+            frontier = reached[frontier_ids]
+            visited[frontier_ids] |= frontier
+            new_bits = np.unpackbits(frontier.astype("<u8").view(np.uint8).reshape(-1,8),axis=1,count=len(source_bits),bitorder="little").view(bool)
+            # newly reached entries are still unreachable, lower them to level
+            columns[frontier_ids] -= new_bits*dtype(unreachable-level)
+        distances[:,start:start+len(source_bits)] = columns
+    return distances
+
+
+def get_route_columns(routing_table):
+    # (dst_ids, next_hops, metrics) of the table's routes as arrays
+    next_hops = getattr(routing_table,"next_hops",None)
+    if next_hops is not None:
+        next_hops = np.asarray(next_hops,dtype=np.int64)
+        dst_ids = np.flatnonzero(next_hops != NO_ROUTE)
+        return dst_ids,next_hops[dst_ids],np.asarray(routing_table.metrics,dtype=np.int64)[dst_ids]
+    routes = routing_table.routes_dict
+    num_routes = len(routes)
+    dst_ids = np.fromiter(routes.keys(),dtype=np.int64,count=num_routes)
+    next_hops = np.fromiter((route[0] for route in routes.values()),dtype=np.int64,count=num_routes)
+    metrics = np.fromiter((route[1] for route in routes.values()),dtype=np.int64,count=num_routes)
+    return dst_ids,next_hops,metrics
+
+
+class RouteScore(object):
+    # per node counts (arrays in node_ids order) of the off-diagonal
+    # entries in each class, totals over the network
+    CLASSES = ("missing","stale","suboptimal","looping")
+
+    def __init__(self, node_ids, reachable_pairs, correct, per_node, looping_destinations, durations):
+        self.node_ids = node_ids
+        self.reachable_pairs = reachable_pairs
+        self.correct = correct
+        self.per_node = per_node
+        # destination id -> number of nodes whose packets loop
+        self.looping_destinations = looping_destinations
+        self.durations = durations
+
+    @property
+    def num_pairs(self):
+        return len(self.node_ids)*(len(self.node_ids)-1)
+
+    def get_total(self, name):
+        return int(self.per_node[name].sum())
+
+    def get_correctness(self):
+        return self.correct/self.num_pairs if self.num_pairs else 1.0
+
+    def get_worst_nodes(self, count=10):
+        # node ids with the most wrong entries
+        wrong = sum(self.per_node[name] for name in self.CLASSES)
+        order = np.argsort(-wrong,kind="stable")[:count]
+        return [(self.node_ids[i],int(wrong[i])) for i in order if wrong[i]]
+
+    def to_dict(self):
+        return {"nodes": len(self.node_ids), "pairs": self.num_pairs, "reachable_pairs": self.reachable_pairs,
+                "correct": self.correct, "correctness": self.get_correctness(),
+                "totals": {name: self.get_total(name) for name in self.CLASSES},
+                "looping_destinations": self.looping_destinations,
+                "worst_nodes": self.get_worst_nodes(), "durations": self.durations}
+
+    def summary(self):
+        lines = ["{} of {} routes correct ({:.4f}), {} pairs reachable".format(self.correct,self.num_pairs,self.get_correctness(),self.reachable_pairs)]
+        lines.append(", ".join("{} {}".format(self.get_total(name),name) for name in self.CLASSES))
+        if self.looping_destinations:
+            lines.append("forwarding loops towards {} destinations".format(len(self.looping_destinations)))
+        worst_nodes = self.get_worst_nodes(5)
+        if worst_nodes:
+            lines.append("worst nodes: "+", ".join("#{} ({})".format(node_id,count) for node_id,count in worst_nodes))
+        lines.append(", ".join("{} {:.3f}s".format(name,duration) for name,duration in self.durations.items()))
+        return "\n".join(lines)
+
+
+class RouteAnalysis(object):
+    def __init__(self, engine, ground_truth=None):
+        if np is None:
+            raise ImportError("route analysis needs numpy, e.g.: pip install numpy")
+        # dsdv_convergence imports the BFS from here
+        from dsdv_convergence import GroundTruth
+        self.engine = engine
+        self.ground_truth = ground_truth or GroundTruth(engine)
+        self.nodes = None
+
+    def get_distances(self):
+        # (node ids, hop count matrix), nodes in locality order, row i holds
+        # the metrics node i should have towards every destination
+        self.nodes,node_ids,distances = self.ground_truth.get_distance_matrix()
+        return node_ids,distances
+
+    def get_hop_count(self, src_id, dst_id):
+        # None when dst_id is unreachable
+        node_ids,distances = self.get_distances()
+        hop_count = distances[np.flatnonzero(node_ids == src_id)[0],np.flatnonzero(node_ids == dst_id)[0]]
+        return None if hop_count == np.iinfo(distances.dtype).max else int(hop_count)
+
+    def get_route_matrices(self, node_ids):
+        # next hop indices (-1: no valid route) and metrics of every node
+        # (rows) towards every destination (columns) in node_ids order,
+        # metrics clipped to the hop count type. Routes to and through
+        # nodes outside the network count as no route
+        num_nodes = len(node_ids)
+        outside = int(node_ids.max())+1 if num_nodes else 0
+        index_of = np.full(outside+1,-1,dtype=np.int64)
+        index_of[node_ids] = np.arange(num_nodes)
+        next_hops = np.full((num_nodes,num_nodes),-1,dtype=get_index_dtype(num_nodes))
+        metric_dtype = get_distance_dtype(num_nodes)
+        max_metric = np.iinfo(metric_dtype).max
+        metrics = np.full((num_nodes,num_nodes),max_metric,dtype=metric_dtype)
+        for i,node in enumerate(self.nodes):
+            dst_ids,next_hop_ids,route_metrics = get_route_columns(node.routing_table)
+            columns = index_of[np.minimum(dst_ids,outside)]
+            next_hop_i = index_of[np.clip(next_hop_ids,0,outside)]
+            valid = (route_metrics < INVALID_METRIC) & (columns >= 0) & (next_hop_i >= 0)
+            next_hops[i,columns[valid]] = next_hop_i[valid]
+            metrics[i,columns[valid]] = np.minimum(route_metrics[valid],max_metric)
+        return next_hops,metrics
+
+    def score(self):
+        durations = dict()
+        start_time = time.time()
+        node_ids,distances = self.get_distances()
+        durations["hop_counts"] = time.time()-start_time
+        start_time = time.time()
+        next_hops,metrics = self.get_route_matrices(node_ids)
+        durations["read_tables"] = time.time()-start_time
+        start_time = time.time()
+
+        # classified ROWS_PER_BLOCK nodes at a time, the temporaries stay
+        # small next to the matrices
+        num_nodes = len(node_ids)
+        unreachable = np.iinfo(distances.dtype).max
+        per_node = {name: np.zeros(num_nodes,dtype=np.int64) for name in RouteScore.CLASSES}
+        reachable_pairs = 0
+        correct = 0
+        # destinations with a forwarding hop that does not get closer
+        no_progress = np.zeros(num_nodes,dtype=bool)
+        for start in range(0,num_nodes,ROWS_PER_BLOCK):
+            rows = slice(start,min(start+ROWS_PER_BLOCK,num_nodes))
+            block_distances = distances[rows]
+            block_metrics = metrics[rows]
+            off_diagonal = np.ones(block_distances.shape,dtype=bool)
+            off_diagonal[np.arange(len(off_diagonal)),np.arange(rows.start,rows.stop)] = False
+            reachable = (block_distances != unreachable) & off_diagonal
+            valid = (next_hops[rows] >= 0) & off_diagonal
+            next_hop_i = np.maximum(next_hops[rows],0)
+            forwards = valid & (np.take_along_axis(block_distances,next_hop_i,axis=1) == 1)
+            stale = valid & (~reachable | ~forwards | (block_metrics < block_distances))
+            per_node["missing"][rows] = np.count_nonzero(reachable & ~valid,axis=1)
+            per_node["stale"][rows] = np.count_nonzero(stale,axis=1)
+            per_node["suboptimal"][rows] = np.count_nonzero(valid & ~stale & (block_metrics > block_distances),axis=1)
+            reachable_pairs += int(np.count_nonzero(reachable))
+            correct += int(np.count_nonzero(reachable & valid & (block_metrics == block_distances)))
+            correct += int(np.count_nonzero(~reachable & ~valid & off_diagonal))
+            no_progress |= (forwards & (np.take_along_axis(distances,next_hop_i,axis=0) >= block_distances)).any(axis=0)
+        durations["classify"] = time.time()-start_time
+        start_time = time.time()
+
+        looping,looping_destinations = self.find_loops(node_ids,distances,next_hops,np.flatnonzero(no_progress))
+        per_node["looping"] = looping
+        durations["loops"] = time.time()-start_time
+        return RouteScore(node_ids.tolist(),reachable_pairs,correct,per_node,looping_destinations,durations)
+
+    def find_loops(self, node_ids, distances, next_hops, columns):
+        # A loop needs a hop that does not get closer to the destination, so
+        # only those destinations (columns) are followed, by pointer doubling
+        # on their next hops. Returns the looping entries per node and per
+        # destination id
+        num_nodes = len(node_ids)
+        looping = np.zeros(num_nodes,dtype=np.int64)
+        looping_destinations = dict()
+        # successor of every node per followed destination, num_nodes is the
+        # sink for delivered and dropped packets
+        sink = num_nodes
+        dtype = get_index_dtype(num_nodes+1)
+        for start in range(0,len(columns),COLUMNS_PER_BLOCK):
+            block_columns = columns[start:start+COLUMNS_PER_BLOCK]
+            block_next_hops = next_hops[:,block_columns]
+            next_hop_i = np.maximum(block_next_hops,0)
+            forwards = (block_next_hops >= 0) & (np.take_along_axis(distances,next_hop_i,axis=1) == 1)
+            successors = np.full((num_nodes+1,len(block_columns)),sink,dtype=dtype)
+            np.copyto(successors[:num_nodes],next_hop_i,where=forwards)
+            successors[block_columns,np.arange(len(block_columns))] = sink
+            steps = 1
+            while steps <= num_nodes:
+                successors = np.take_along_axis(successors,successors,axis=0)
+                steps *= 2
+                if (successors == sink).all():
+                    break
+            block_looping = successors[:num_nodes] != sink
+            looping += np.count_nonzero(block_looping,axis=1)
+            for column,count in zip(block_columns,np.count_nonzero(block_looping,axis=0)):
+                if count:
+                    looping_destinations[int(node_ids[column])] = int(count)
+        return looping,looping_destinations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="route quality of a DSDV simulation against the shortest paths")
+    parser.add_argument("--nodes", type=int, default=100)
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--every", type=int, default=None, help="also score every N ticks while running")
+    parser.add_argument("--output", default=None, help="write the final score as JSON")
+    add_engine_arguments(parser)
+    args = parser.parse_args()
+
+    engine = create_engine(args.width,args.height,seed=args.seed,**get_engine_kwargs(args))
+    engine.initialise_network(args.nodes)
+    analysis = RouteAnalysis(engine)
+    for tick in range(args.ticks):
+        engine.step()
+        if args.every and (tick+1)%args.every == 0 and tick+1 < args.ticks:
+            score = analysis.score()
+            print("tick {}: {:.4f} correct, {}".format(engine.tick,score.get_correctness(),", ".join("{} {}".format(score.get_total(name),name) for name in RouteScore.CLASSES)))
+    score = analysis.score()
+    print("tick {}:".format(engine.tick))
+    print(score.summary())
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(score.to_dict(), f, indent=1)
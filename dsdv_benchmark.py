@@ -0,0 +1,236 @@
+import argparse
+import json
+import math
+import platform
+import random
+import statistics
+import sys
+import time
+
+from dsdv_engine import create_engine, add_engine_arguments, get_engine_kwargs
+from dsdv_topology import TOPOLOGIES, generate_positions
+from dsdv_routing import RouteBatch, ROUTING_TABLE_BACKENDS
+from dsdv_convergence import run_until_converged, get_message_count
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Reproducible, headless benchmarks of the simulation hot paths. Every
+# benchmark builds its input from a fixed seed in an untimed setup, times the
+# run, and reports the minimum and median over the repeats. Results are JSON,
+# --compare flags benchmarks whose minimum got slower than a stored baseline.
+
+SEED = 1
+# area per node of the GUI's default network (1100x800, ~100 nodes), larger
+# networks get a proportionally larger square so the density stays the same
+AREA_PER_NODE = 8800
+
+def get_side(num_nodes):
+    return int(math.sqrt(num_nodes*AREA_PER_NODE))
+
+def build_engine(num_nodes, engine_kwargs, connect=True):
+    side = get_side(num_nodes)
+    engine = create_engine(side,side,seed=SEED,**engine_kwargs)
+    engine.number_nodes = num_nodes
+    engine.create_random_nodes()
+    if connect:
+        engine.connect_nodes()
+    return engine
+
+
+def measure(run, setup=None, repeat=3):
+    timings = []
+    info = dict()
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        start_time = time.perf_counter()
+        info = run(state) or dict()
+        timings.append(time.perf_counter()-start_time)
+    result = {"min": min(timings), "median": statistics.median(timings), "timings": timings}
+    result.update(info)
+    return result
+
+
+# ---- benchmarks, each yields (name, setup, run) ----
+
+def topology_benchmarks(sizes, engine_kwargs):
+    for topology in TOPOLOGIES:
+        for num_nodes in sizes:
+            side = get_side(num_nodes)
+            def run(state, topology=topology, num_nodes=num_nodes, side=side):
+                positions = generate_positions(topology,num_nodes,side,side,rng=random.Random(SEED))
+                return {"nodes": len(positions)}
+            yield "topology/{}/n={}".format(topology,num_nodes),None,run
+
+def connect_nodes_benchmarks(sizes, engine_kwargs):
+    for num_nodes in sizes:
+        def setup(num_nodes=num_nodes):
+            return build_engine(num_nodes,engine_kwargs,connect=False)
+        def run(engine):
+            engine.connect_nodes()
+            return {"edges": len(engine.edges)}
+        yield "connect_nodes/n={}".format(num_nodes),setup,run
+
+def broadcast_round_benchmarks(sizes, engine_kwargs, warmup_ticks=20):
+    # one tick in which every node broadcasts its (warmed up) table
+    for num_nodes in sizes:
+        def setup(num_nodes=num_nodes):
+            engine = build_engine(num_nodes,engine_kwargs)
+            engine.run(warmup_ticks)
+            for node in engine.nodes:
+                engine.trigger_update(node)
+            return engine
+        def run(engine):
+            messages = get_message_count(engine)
+            engine.step()
+            return {"messages": get_message_count(engine)-messages}
+        yield "broadcast_round/n={}".format(num_nodes),setup,run
+
+def routing_table_update_benchmarks(sizes, engine_kwargs, routes_per_run=100000):
+    # a neighbour advertises table_size routes, "learn": all of them are new,
+    # "refresh": all of them have a newer seq number, "no_news": all are known.
+    # Each run updates enough tables to process routes_per_run routes
+    def make_packet(engine, table_size, seq_offset):
+        send_dict = {dst_id: (1, 1+dst_id%7, seq_offset+2*(dst_id%50)) for dst_id in range(2,table_size+2)}
+        if engine.routing_table_backend == "numpy":
+            return RouteBatch.from_mapping(send_dict)
+        return send_dict
+
+    for table_size in sizes:
+        for case,seq_offsets in (("learn",(0,)),("refresh",(0,2)),("no_news",(0,0))):
+            def setup(table_size=table_size, seq_offsets=seq_offsets):
+                engine = create_engine(1100,800,seed=SEED,**engine_kwargs)
+                node = engine.add_node(100,100,0)
+                engine.add_node(150,100,1)
+                packets = [make_packet(engine,table_size,seq_offset) for seq_offset in seq_offsets]
+                routing_tables = [engine.routing_table_class(node) for _ in range(max(1,routes_per_run//table_size))]
+                for routing_table in routing_tables:
+                    for packet in packets[:-1]:
+                        routing_table.update(packet,0)
+                return routing_tables,packets[-1]
+            def run(state):
+                routing_tables,packet = state
+                start_time = time.perf_counter()
+                for routing_table in routing_tables:
+                    routing_table.update(packet,1)
+                return {"updates": len(routing_tables), "per_update": (time.perf_counter()-start_time)/len(routing_tables)}
+            yield "routing_table_update/{}/routes={}".format(case,table_size),setup,run
+
+def convergence_benchmarks(sizes, engine_kwargs, max_ticks=200):
+    for num_nodes in sizes:
+        def setup(num_nodes=num_nodes):
+            return build_engine(num_nodes,engine_kwargs)
+        def run(engine):
+            checker = run_until_converged(engine,max_ticks)
+            return {"ticks": engine.tick, "converged": checker.convergence_tick is not None,
+                    "messages": get_message_count(engine), "table_correctness": checker.get_correctness()}
+        yield "convergence/n={}".format(num_nodes),setup,run
+
+
+def get_suite(quick, engine_kwargs, max_ticks):
+    if quick:
+        sizes = {"topology": [1000], "connect_nodes": [1000], "broadcast_round": [100], "routing_table_update": [10,100,1000], "convergence": [100]}
+    else:
+        sizes = {"topology": [1000,10000], "connect_nodes": [1000,10000], "broadcast_round": [100,1000],
+                 "routing_table_update": [10,100,1000,10000], "convergence": [100,1000,10000]}
+    yield from topology_benchmarks(sizes["topology"],engine_kwargs)
+    yield from connect_nodes_benchmarks(sizes["connect_nodes"],engine_kwargs)
+    yield from broadcast_round_benchmarks(sizes["broadcast_round"],engine_kwargs)
+    yield from routing_table_update_benchmarks(sizes["routing_table_update"],engine_kwargs)
+    yield from convergence_benchmarks(sizes["convergence"],engine_kwargs,max_ticks)
+
+
+def run_suite(quick=False, repeat=3, name_filter=None, engine_kwargs=None, max_ticks=200, log=None):
+    engine_kwargs = engine_kwargs or dict()
+    results = dict()
+    for name,setup,run in get_suite(quick,engine_kwargs,max_ticks):
+        if name_filter is not None and name_filter not in name:
+            continue
+        # a single end to end run is expensive enough to be stable
+        results[name] = measure(run,setup,1 if name.startswith("convergence/") else repeat)
+        if log is not None:
+            log("{:<45} {:>10.4f}s".format(name,results[name]["min"]))
+    return {"environment": {"python": platform.python_version(), "implementation": platform.python_implementation(),
+                            "platform": platform.platform(), "numpy": np.__version__ if np is not None else None,
+                            "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "settings": {"seed": SEED, "quick": quick, "repeat": repeat, "max_ticks": max_ticks, "engine": engine_kwargs},
+            "results": results}
+
+
+def get_node_state(node):
+    routing_table = node.routing_table
+    return ({dst_id: list(route) for dst_id,route in routing_table.routes_dict.items()},dict(node.neighbours),
+            node.periodic_update_counter,routing_table.seq_number)
+
+def verify_backends(num_nodes, ticks, engine_kwargs=None, log=None):
+    # differential check of the vectorised routing tables: every backend
+    # runs the same seeded network, its tables, neighbours and stats must be
+    # those of the dict backend. Returns the backends that differ
+    engine_kwargs = dict(engine_kwargs or dict())
+    engine_kwargs.pop("routing_table_backend",None)
+    expected = None
+    different = []
+    for backend in ROUTING_TABLE_BACKENDS:
+        engine = build_engine(num_nodes,dict(engine_kwargs,routing_table_backend=backend))
+        engine.run(ticks)
+        state = [get_node_state(node) for node in engine.nodes],engine.stats
+        if expected is None:
+            expected = state
+            different_nodes = 0
+        else:
+            different_nodes = sum(1 for a,b in zip(state[0],expected[0]) if not a == b)
+            if not state == expected:
+                different.append(backend)
+        if log is not None:
+            log("{:<8} {} of {} nodes differ{}".format(backend,different_nodes,num_nodes,"" if state[1] == expected[1] else ", stats differ"))
+    return different
+
+
+def compare(results, baseline, threshold=0.2):
+    # returns [(name, baseline min, min, ratio, slower)] for the benchmarks in both
+    rows = []
+    for name,result in results["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = result["min"]/base["min"] if base["min"] > 0 else float("inf")
+        rows.append((name,base["min"],result["min"],ratio,ratio > 1+threshold))
+    return rows
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the DSDV simulation hot paths")
+    parser.add_argument("--quick", action="store_true", help="small sizes only, no 10k node runs")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--filter", default=None, help="only benchmarks whose name contains this")
+    parser.add_argument("--max-ticks", type=int, default=200, help="tick limit of the convergence runs")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", default=None, help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown that is flagged")
+    parser.add_argument("--verify", action="store_true", help="instead of benchmarking, check that all routing table backends compute the same tables")
+    parser.add_argument("--verify-nodes", type=int, default=300)
+    add_engine_arguments(parser)
+    args = parser.parse_args()
+
+    if args.verify:
+        different = verify_backends(args.verify_nodes,args.max_ticks,get_engine_kwargs(args),log=print)
+        print("backends {}".format("DIFFERENT: "+", ".join(different) if different else "identical"))
+        sys.exit(1 if different else 0)
+
+    results = run_suite(args.quick,args.repeat,args.filter,get_engine_kwargs(args),args.max_ticks,log=print)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
+    print("written to {}".format(args.output))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare(results,baseline,args.threshold)
+        for name,base_time,new_time,ratio,slower in rows:
+            print("{:<45} {:>10.4f}s {:>10.4f}s {:>6.2f}x{}".format(name,base_time,new_time,ratio,"  SLOWER" if slower else ""))
+        num_slower = sum(1 for row in rows if row[4])
+        print("{} of {} benchmarks slower than {:.0%} over the baseline".format(num_slower,len(rows),args.threshold))
+        sys.exit(1 if num_slower else 0)
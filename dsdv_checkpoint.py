@@ -0,0 +1,426 @@
+import argparse
+import itertools
+import json
+import struct
+import zlib
+from array import array
+
+from dsdv_engine import create_engine
+from dsdv_mobility import MOBILITY_MODELS
+from dsdv_medium import MEDIUMS
+from dsdv_routing import RoutingTable, RouteBatch
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Snapshot of a whole simulation, resumable bit for bit:
+#
+#   CHECKPOINT_HEADER (magic, version, metadata size)
+#   metadata          JSON: engine settings, tick, stats, rng state, medium, mobility
+#                     state and the column directory
+#   columns           one zlib compressed blob per column
+#
+# Per-node values are stored as columns indexed like engine.nodes, variable
+# length data (neighbours, routes, pending messages) as flat columns plus a
+# count per owner. Routing tables are stored in the layout of their backend:
+# "dict" tables sparse as dst ids plus (next hop, metric, seq, install time)
+# interleaved per route,
+# "array" and "numpy" tables as their raw columns. The metric/route change
+# sets of ConvergenceChecker and TraceRecorder are not part of a checkpoint.
+
+CHECKPOINT_MAGIC = b"DSDVCKPT"
+CHECKPOINT_VERSION = 1
+CHECKPOINT_HEADER = struct.Struct("<8sIQ")
+
+ENGINE_SETTINGS = ("width","height","message_mode","full_dump_interval","routing_table_backend","topology","seed","rng_streams","rng_key",
+                   "node_margin","node_tx_range","node_min_distance","node_at_most_one_max_distance",
+                   "node_periodic_update_delay","link_notifications","tick","update_step_type","topology_version")
+
+class ColumnWriter(object):
+    def __init__(self, compress_level):
+        self.compress_level = compress_level
+        self.directory = dict()
+        self.blobs = []
+        self.offset = 0
+
+    def add(self, name, typecode, data):
+        # data: an array of typecode, a NumPy array of the same item type,
+        # its raw bytes or a list
+        if isinstance(data, list):
+            data = array(typecode, data)
+        raw = data if isinstance(data, bytes) else data.tobytes()
+        blob = zlib.compress(raw, self.compress_level) if self.compress_level else raw
+        self.directory[name] = {"typecode": typecode, "size": len(raw), "offset": self.offset, "stored": len(blob)}
+        self.blobs.append(blob)
+        self.offset += len(blob)
+
+
+class ColumnReader(object):
+    def __init__(self, directory, buffer, compressed):
+        self.directory = directory
+        self.buffer = buffer
+        self.compressed = compressed
+
+    def __contains__(self, name):
+        return name in self.directory
+
+    def get_bytes(self, name):
+        column = self.directory[name]
+        blob = self.buffer[column["offset"]:column["offset"]+column["stored"]]
+        return zlib.decompress(blob) if self.compressed else bytes(blob)
+
+    def get(self, name):
+        column = array(self.directory[name]["typecode"])
+        column.frombytes(self.get_bytes(name))
+        return column
+
+    def get_numpy(self, name, dtype):
+        return np.frombuffer(self.get_bytes(name), dtype=dtype).copy()
+
+
+# ---- saving ----
+
+def get_rng_state(rng):
+    version,internal_state,gauss_next = rng.getstate()
+    return [version,list(internal_state),gauss_next]
+
+def set_rng_state(rng, state):
+    version,internal_state,gauss_next = state
+    rng.setstate((version,tuple(internal_state),gauss_next))
+
+def get_mobility_state(engine):
+    mobility = engine.mobility
+    if mobility is None:
+        return None
+    names = [name for name,model_class in MOBILITY_MODELS.items() if type(mobility) is model_class]
+    if not names:
+        raise ValueError("cannot checkpoint mobility model {!r}, it is not in MOBILITY_MODELS".format(mobility))
+    params = {k: v for k,v in vars(mobility).items() if k not in ("rng","states")}
+    states = {node.node_id: state for node,state in mobility.states.items()}
+    return {"name": names[0], "params": params, "states": states}
+
+def get_medium_state(engine):
+    names = [name for name,medium_class in MEDIUMS.items() if type(engine.medium) is medium_class]
+    if not names:
+        raise ValueError("cannot checkpoint medium {!r}, it is not in MEDIUMS".format(engine.medium))
+    return {"name": names[0], "params": {k: v for k,v in vars(engine.medium).items() if not k == "rng"}}
+
+
+def add_message(messages, node, message):
+    src_id,routing_table = node.decode_packet(message)
+    messages["src_ids"].append(src_id)
+    messages["num_entries"].append(len(routing_table))
+    for dst_id,(next_hop,metric,seq_num) in routing_table.items():
+        messages["dst_ids"].append(dst_id)
+        messages["next_hops"].append(next_hop)
+        messages["metrics"].append(metric)
+        messages["seq_numbers"].append(seq_num)
+    return len(messages["src_ids"])-1
+
+
+def write_routing_tables(writer, engine):
+    nodes = engine.nodes
+    writer.add("seq_numbers","i",[node.routing_table.seq_number for node in nodes])
+    if engine.routing_table_class is RoutingTable:
+        num_routes = array("i")
+        dst_ids = array("i")
+        route_values = array("i")
+        dirty_counts = array("i")
+        dirty_ids = array("i")
+        for node in nodes:
+            routing_table = node.routing_table
+            num_routes.append(len(routing_table.routes_dict))
+            dst_ids.extend(routing_table.routes_dict.keys())
+            route_values.extend(itertools.chain.from_iterable(routing_table.routes_dict.values()))
+            dirty_counts.append(len(routing_table.dirty))
+            dirty_ids.extend(sorted(routing_table.dirty))
+        writer.add("routes_per_node","i",num_routes)
+        writer.add("route_dst_ids","i",dst_ids)
+        writer.add("route_values","i",route_values)
+        writer.add("dirty_per_node","i",dirty_counts)
+        writer.add("dirty_ids","i",dirty_ids)
+        return
+
+    tables = [node.routing_table for node in nodes]
+    writer.add("routes_per_node","i",[table.num_routes for table in tables])
+    writer.add("capacity_per_node","i",[len(table.next_hops) for table in tables])
+    numpy_columns = np is not None and tables and isinstance(tables[0].next_hops, np.ndarray)
+    for name in ("next_hops","metrics","seq_numbers","install_times"):
+        if numpy_columns:
+            writer.add("column_"+name,"i",np.concatenate([getattr(table,name) for table in tables]).astype(np.int32))
+        else:
+            writer.add("column_"+name,"i",b"".join([getattr(table,name).tobytes() for table in tables]))
+    if numpy_columns:
+        writer.add("dirty_flags","B",np.concatenate([table.dirty for table in tables]).astype(np.uint8))
+    else:
+        writer.add("dirty_per_node","i",[len(table.dirty) for table in tables])
+        writer.add("dirty_ids","i",[dst_id for table in tables for dst_id in sorted(table.dirty)])
+
+
+def write_event_state(writer, engine, messages, message_ids, metadata):
+    from dsdv_events import CHECK_NEIGHBOURS, TRANSMISSION, DELIVERY
+    columns = {name: [] for name in ("time","kind","order_key","counter","node","other","message","tx_range")}
+    for time,kind,order_key,counter,args in engine.scheduler.queue:
+        node,other,message,tx_range = args[0].node_id,-1,None,0.0
+        if kind == CHECK_NEIGHBOURS:
+            other = -1 if args[1] is None else args[1]
+        elif kind == TRANSMISSION:
+            message,tx_range,other = args[1],args[2],args[3]
+        elif kind == DELIVERY:
+            message,other = args[1],args[2].node_id
+        message_i = -1
+        if message is not None:
+            if id(message) not in message_ids:
+                message_ids[id(message)] = add_message(messages,args[0],message)
+            message_i = message_ids[id(message)]
+        for name,value in zip(("time","kind","order_key","counter","node","other","message","tx_range"),
+                              (time,kind,order_key,counter,node,other,message_i,tx_range)):
+            columns[name].append(value)
+    for name,typecode in (("time","d"),("kind","i"),("order_key","q"),("counter","q"),("node","i"),("other","i"),("message","i"),("tx_range","d")):
+        writer.add("event_"+name,typecode,columns[name])
+
+    writer.add("next_send_nodes","i",[node.node_id for node in engine.next_send_times])
+    writer.add("next_send_times","d",list(engine.next_send_times.values()))
+    writer.add("timeout_nodes","i",[node.node_id for node,src_id in engine.neighbour_timeouts])
+    writer.add("timeout_src_ids","i",[src_id for node,src_id in engine.neighbour_timeouts])
+    writer.add("timeout_times","d",list(engine.neighbour_timeouts.values()))
+    writer.add("check_nodes","i",[node.node_id for node in engine.neighbour_checks])
+    writer.add("check_times","d",list(engine.neighbour_checks.values()))
+    writer.add("lost_neighbour_nodes","i",sorted(node.node_id for node in engine.nodes_with_lost_neighbours))
+    metadata["scheduler"] = "event"
+    metadata["event_engine"] = {"propagation_delay": engine.propagation_delay, "propagation_speed": engine.propagation_speed,
+                                "now": engine.now, "transmission_counter": engine.transmission_counter,
+                                "scheduler_counter": engine.scheduler.counter}
+
+
+def save_checkpoint(engine, path, compress_level=1):
+    # compress_level 0 stores the columns uncompressed
+    nodes = engine.nodes
+    for i,node in enumerate(nodes):
+        if not node.node_id == i:
+            raise ValueError("checkpoints need node ids 0..n-1 in order, node {} has id {}".format(i,node.node_id))
+    metadata = {name: getattr(engine,name) for name in ENGINE_SETTINGS}
+    metadata.update({"scheduler": "tick", "stats": engine.stats, "rng_state": get_rng_state(engine.rng),
+                     "medium": get_medium_state(engine), "mobility": get_mobility_state(engine), "number_nodes": len(nodes)})
+    writer = ColumnWriter(compress_level)
+
+    writer.add("cor_x","d",[node.cor_x for node in nodes])
+    writer.add("cor_y","d",[node.cor_y for node in nodes])
+    writer.add("tx_range","d",[node.tx_range for node in nodes])
+    writer.add("periodic_update_range","i",[value for node in nodes for value in node.periodic_update_range])
+    writer.add("periodic_update_delay","i",[node.periodic_update_delay for node in nodes])
+    writer.add("periodic_update_counter","i",[node.periodic_update_counter for node in nodes])
+    writer.add("last_full_dump_tick","i",[-1 if node.last_full_dump_tick is None else node.last_full_dump_tick for node in nodes])
+    writer.add("update_triggered","B",[node.update_triggered for node in nodes])
+    writer.add("rng_draws","q",[node.rng_draws for node in nodes])
+
+    writer.add("edge_n1","i",[edge.n1.node_id for edge in engine.edges])
+    writer.add("edge_n2","i",[edge.n2.node_id for edge in engine.edges])
+
+    writer.add("neighbours_per_node","i",[len(node.neighbours) for node in nodes])
+    writer.add("neighbour_ids","i",[src_id for node in nodes for src_id in node.neighbours])
+    writer.add("neighbour_ticks","i",[heard for node in nodes for heard in node.neighbours.values()])
+
+    write_routing_tables(writer,engine)
+
+    messages = {name: [] for name in ("src_ids","num_entries","dst_ids","next_hops","metrics","seq_numbers")}
+    message_ids = dict()
+    transmissions = engine.medium_transmission_buffer
+    writer.add("transmission_nodes","i",[send_node.node_id for send_node,message,tx_range in transmissions])
+    writer.add("transmission_tx_ranges","d",[tx_range for send_node,message,tx_range in transmissions])
+    writer.add("transmission_messages","i",[add_message(messages,send_node,message) for send_node,message,tx_range in transmissions])
+    if hasattr(engine, "scheduler"):
+        write_event_state(writer,engine,messages,message_ids,metadata)
+    for name,column in messages.items():
+        writer.add("message_"+name,"i",column)
+
+    metadata["compressed"] = bool(compress_level)
+    metadata["columns"] = writer.directory
+    metadata_bytes = json.dumps(metadata).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC,CHECKPOINT_VERSION,len(metadata_bytes)))
+        f.write(metadata_bytes)
+        for blob in writer.blobs:
+            f.write(blob)
+
+
+# ---- loading ----
+
+def get_offsets(counts):
+    offsets = [0]
+    for count in counts:
+        offsets.append(offsets[-1]+count)
+    return offsets
+
+
+def read_messages(engine, columns):
+    src_ids = columns.get("message_src_ids")
+    offsets = get_offsets(columns.get("message_num_entries"))
+    dst_ids,next_hops,metrics,seq_numbers = (columns.get("message_"+name) for name in ("dst_ids","next_hops","metrics","seq_numbers"))
+    messages = []
+    for i,src_id in enumerate(src_ids):
+        start,end = offsets[i],offsets[i+1]
+        send_dict = {dst_id: (next_hop,metric,seq_num) for dst_id,next_hop,metric,seq_num
+                     in zip(dst_ids[start:end],next_hops[start:end],metrics[start:end],seq_numbers[start:end])}
+        if engine.routing_table_backend == "numpy":
+            send_dict = RouteBatch.from_mapping(send_dict)
+        messages.append(engine.nodes[src_id].encode_packet(send_dict))
+    return messages
+
+
+def read_routing_tables(engine, columns):
+    nodes = engine.nodes
+    for node,seq_number in zip(nodes,columns.get("seq_numbers")):
+        node.routing_table.seq_number = seq_number
+    routes_per_node = columns.get("routes_per_node")
+    if engine.routing_table_class is RoutingTable:
+        offsets = get_offsets(routes_per_node)
+        dst_ids = columns.get("route_dst_ids").tolist()
+        route_values = columns.get("route_values").tolist()
+        for i,node in enumerate(nodes):
+            start,end = offsets[i],offsets[i+1]
+            values = route_values[4*start:4*end]
+            node.routing_table.routes_dict = dict(zip(dst_ids[start:end],[values[j:j+4] for j in range(0,len(values),4)]))
+    else:
+        offsets = get_offsets(columns.get("capacity_per_node"))
+        for name in ("next_hops","metrics","seq_numbers","install_times"):
+            if engine.routing_table_backend == "numpy":
+                column = columns.get_numpy("column_"+name,np.int32)
+            else:
+                column = columns.get("column_"+name)
+            for i,node in enumerate(nodes):
+                setattr(node.routing_table,name,column[offsets[i]:offsets[i+1]])
+        for node,num_routes in zip(nodes,routes_per_node):
+            node.routing_table.num_routes = num_routes
+        if "dirty_flags" in columns:
+            dirty_flags = columns.get_numpy("dirty_flags",np.uint8).astype(bool)
+            for i,node in enumerate(nodes):
+                node.routing_table.dirty = dirty_flags[offsets[i]:offsets[i+1]].copy()
+            return
+
+    offsets = get_offsets(columns.get("dirty_per_node"))
+    dirty_ids = columns.get("dirty_ids")
+    for i,node in enumerate(nodes):
+        node.routing_table.dirty = set(dirty_ids[offsets[i]:offsets[i+1]])
+
+
+def read_event_state(engine, columns, metadata, messages):
+    from dsdv_events import CHECK_NEIGHBOURS, SEND_UPDATE, TRANSMISSION
+    event_state = metadata["event_engine"]
+    nodes = engine.nodes
+    queue = []
+    names = ("time","kind","order_key","counter","node","other","message","tx_range")
+    for time,kind,order_key,counter,node_id,other,message_i,tx_range in zip(*(columns.get("event_"+name) for name in names)):
+        node = nodes[node_id]
+        if kind == CHECK_NEIGHBOURS:
+            args = (node, None if other == -1 else other)
+        elif kind == SEND_UPDATE:
+            args = (node,)
+        elif kind == TRANSMISSION:
+            args = (node, messages[message_i], tx_range, other)
+        else:
+            args = (node, messages[message_i], nodes[other])
+        queue.append((time,kind,order_key,counter,args))
+    # the stored list already is a heap
+    engine.scheduler.queue = queue
+    engine.scheduler.counter = event_state["scheduler_counter"]
+    engine.now = event_state["now"]
+    engine.transmission_counter = event_state["transmission_counter"]
+    engine.next_send_times = {nodes[node_id]: time for node_id,time in zip(columns.get("next_send_nodes"),columns.get("next_send_times"))}
+    engine.neighbour_timeouts = {(nodes[node_id],src_id): time for node_id,src_id,time
+                                 in zip(columns.get("timeout_nodes"),columns.get("timeout_src_ids"),columns.get("timeout_times"))}
+    engine.neighbour_checks = {nodes[node_id]: time for node_id,time in zip(columns.get("check_nodes"),columns.get("check_times"))}
+    engine.nodes_with_lost_neighbours = {nodes[node_id] for node_id in columns.get("lost_neighbour_nodes")}
+
+
+def load_checkpoint(path):
+    # returns a new engine in exactly the saved state, observers have to be
+    # added again
+    with open(path, "rb") as f:
+        data = f.read()
+    magic,version,metadata_size = CHECKPOINT_HEADER.unpack_from(data,0)
+    if not magic == CHECKPOINT_MAGIC:
+        raise ValueError("{} is not a DSDV checkpoint".format(path))
+    if not version == CHECKPOINT_VERSION:
+        raise ValueError("unsupported checkpoint version {}".format(version))
+    start = CHECKPOINT_HEADER.size
+    metadata = json.loads(data[start:start+metadata_size].decode("utf-8"))
+    columns = ColumnReader(metadata["columns"],memoryview(data)[start+metadata_size:],metadata["compressed"])
+
+    kwargs = {name: metadata[name] for name in ("message_mode","full_dump_interval","routing_table_backend","topology","seed","rng_streams")}
+    if metadata["scheduler"] == "event":
+        kwargs["propagation_delay"] = metadata["event_engine"]["propagation_delay"]
+        kwargs["propagation_speed"] = metadata["event_engine"]["propagation_speed"]
+    kwargs["medium"] = metadata["medium"]["name"]
+    mobility = metadata["mobility"]
+    if mobility is not None:
+        kwargs["mobility"] = mobility["name"]
+    engine = create_engine(metadata["width"],metadata["height"],scheduler=metadata["scheduler"],**kwargs)
+    for name in ("rng_key","node_margin","node_tx_range","node_min_distance","node_at_most_one_max_distance","node_periodic_update_delay","link_notifications"):
+        setattr(engine,name,metadata[name])
+    engine.reset_network()
+
+    for node_id,(cor_x,cor_y) in enumerate(zip(columns.get("cor_x"),columns.get("cor_y"))):
+        engine.add_node(cor_x,cor_y,node_id)
+    nodes = engine.nodes
+    engine.number_nodes = len(nodes)
+    periodic_update_range = columns.get("periodic_update_range")
+    for i,(node,tx_range,delay,counter,last_full_dump_tick) in enumerate(zip(nodes,columns.get("tx_range"),columns.get("periodic_update_delay"),
+                                                                               columns.get("periodic_update_counter"),columns.get("last_full_dump_tick"))):
+        node.tx_range = tx_range
+        node.periodic_update_range = (periodic_update_range[2*i],periodic_update_range[2*i+1])
+        node.periodic_update_delay = delay
+        node.periodic_update_counter = counter
+        node.last_full_dump_tick = None if last_full_dump_tick == -1 else last_full_dump_tick
+    for node,update_triggered,rng_draws in zip(nodes,columns.get("update_triggered"),columns.get("rng_draws")):
+        node.update_triggered = bool(update_triggered)
+        node.rng_draws = rng_draws
+    for n1_id,n2_id in zip(columns.get("edge_n1"),columns.get("edge_n2")):
+        engine.add_edge(nodes[n1_id],nodes[n2_id])
+
+    offsets = get_offsets(columns.get("neighbours_per_node"))
+    neighbour_ids = columns.get("neighbour_ids")
+    neighbour_ticks = columns.get("neighbour_ticks")
+    for i,node in enumerate(nodes):
+        node.neighbours = dict(zip(neighbour_ids[offsets[i]:offsets[i+1]],neighbour_ticks[offsets[i]:offsets[i+1]]))
+
+    read_routing_tables(engine,columns)
+
+    messages = read_messages(engine,columns)
+    engine.medium_transmission_buffer = [(nodes[node_id],messages[message_i],tx_range) for node_id,tx_range,message_i
+                                         in zip(columns.get("transmission_nodes"),columns.get("transmission_tx_ranges"),columns.get("transmission_messages"))]
+    if metadata["scheduler"] == "event":
+        read_event_state(engine,columns,metadata,messages)
+
+    for name,value in metadata["medium"]["params"].items():
+        setattr(engine.medium,name,value)
+    if mobility is not None:
+        for name,value in mobility["params"].items():
+            setattr(engine.mobility,name,tuple(value) if isinstance(value, list) else value)
+        engine.mobility.states = {nodes[int(node_id)]: state for node_id,state in mobility["states"].items()}
+
+    engine.tick = metadata["tick"]
+    engine.update_step_type = metadata["update_step_type"]
+    engine.topology_version = metadata["topology_version"]
+    engine.stats = metadata["stats"]
+    set_rng_state(engine.rng,metadata["rng_state"])
+    return engine
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="resume a headless DSDV simulation from a checkpoint")
+    parser.add_argument("checkpoint")
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--checkpoint-every", type=int, default=None, help="overwrite the checkpoint every N ticks")
+    args = parser.parse_args()
+
+    engine = load_checkpoint(args.checkpoint)
+    print("resumed {} nodes at tick {}".format(len(engine.nodes),engine.tick))
+    for tick in range(args.ticks):
+        engine.step()
+        if args.checkpoint_every and (tick+1)%args.checkpoint_every == 0:
+            save_checkpoint(engine,args.checkpoint)
+    print("{full_dumps} full dumps, {incremental_updates} incremental updates, {bytes_sent} bytes sent, {bytes_saved} bytes saved".format(**engine.stats))
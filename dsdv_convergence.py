@@ -0,0 +1,206 @@
+from collections import deque
+
+from dsdv_routing import INVALID_METRIC
+from dsdv_analysis import ROWS_PER_BLOCK, all_pairs_hop_counts, get_locality_order, get_route_columns
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class GroundTruth(object):
+    # shortest hop counts on the connectivity graph, a node's metric for dst
+    # is the number of broadcasts needed to get from dst to the node, a
+    # broadcast reaches the nodes within the sender's tx_range. BFS runs
+    # lazily per node, or with numpy for all nodes at once in
+    # get_distance_matrix. The cache is kept until a topology change
+    # (engine.topology_version) changes which node hears which
+    def __init__(self, engine):
+        self.engine = engine
+        self.topology_version = None
+        self.engine_nodes = []
+        self.heard_from = dict()
+        self.distances = dict()
+        self.nodes = []
+        self.node_ids = None
+        self.matrix = None
+
+    def refresh(self):
+        if self.topology_version == self.engine.topology_version:
+            return False
+        self.topology_version = self.engine.topology_version
+        heard_from = {node.node_id: [] for node in self.engine.nodes}
+        for node in self.engine.nodes:
+            for receiver in self.engine.nodes_in_range(node.cor_x,node.cor_y,node.tx_range):
+                if not receiver == node:
+                    heard_from[receiver.node_id].append(node.node_id)
+        for src_ids in heard_from.values():
+            src_ids.sort()
+        # moves that keep every link do not change the hop counts
+        if heard_from == self.heard_from and self.engine_nodes == self.engine.nodes:
+            return False
+        self.engine_nodes = list(self.engine.nodes)
+        self.heard_from = heard_from
+        self.distances = dict()
+        self.matrix = None
+        return True
+
+    def get_distance_matrix(self):
+        # (nodes, node ids, hop counts), nodes in locality order, row i holds
+        # the distances of node i, column j the hop counts from node j (the
+        # dtype's maximum: unreachable). numpy only
+        self.refresh()
+        if self.matrix is None:
+            nodes = self.engine.nodes
+            self.nodes = [nodes[i] for i in get_locality_order([node.cor_x for node in nodes],[node.cor_y for node in nodes])]
+            self.node_ids = np.array([node.node_id for node in self.nodes],dtype=np.int64)
+            index = {node_id: i for i,node_id in enumerate(self.node_ids.tolist())}
+            senders = []
+            receivers = []
+            for node_id,src_ids in self.heard_from.items():
+                senders.extend(index[src_id] for src_id in src_ids)
+                receivers.extend([index[node_id]]*len(src_ids))
+            # drop the old matrix before building the new one
+            self.matrix = None
+            self.matrix = all_pairs_hop_counts(len(self.nodes),np.array(senders,dtype=np.intp),np.array(receivers,dtype=np.intp),directed=True)
+        return self.nodes,self.node_ids,self.matrix
+
+    def get_distances(self, node_id):
+        self.refresh()
+        distances = self.distances.get(node_id)
+        if distances is None and self.matrix is not None:
+            row = self.matrix[np.flatnonzero(self.node_ids == node_id)[0]]
+            reachable = np.flatnonzero(row != np.iinfo(row.dtype).max)
+            distances = dict(zip(self.node_ids[reachable].tolist(),row[reachable].tolist()))
+            self.distances[node_id] = distances
+        elif distances is None:
+            distances = {node_id: 0}
+            queue = deque([node_id])
+            while queue:
+                current = queue.popleft()
+                for src_id in self.heard_from[current]:
+                    if src_id not in distances:
+                        distances[src_id] = distances[current]+1
+                        queue.append(src_id)
+            self.distances[node_id] = distances
+        return distances
+
+
+def is_route_correct(routes_dict, dst_id, distances):
+    route = routes_dict.get(dst_id)
+    if dst_id in distances:
+        return route is not None and route[1] == distances[dst_id]
+    return route is None or route[1] >= INVALID_METRIC
+
+def get_message_count(engine):
+    return engine.stats["full_dumps"]+engine.stats["incremental_updates"]
+
+
+class ConvergenceChecker(object):
+    # keeps the set of wrong (node, destination) entries up to date from the
+    # routing tables' metric changes, so a check costs O(changed routes)
+    # except right after a topology change
+    def __init__(self, engine, ground_truth=None):
+        # ground_truth: shared with e.g. a dsdv_analysis.RouteAnalysis
+        self.engine = engine
+        self.ground_truth = ground_truth or GroundTruth(engine)
+        self.topology_version = None
+        self.wrong = dict()
+        self.num_wrong = 0
+        self.convergence_tick = None
+        self.convergence_messages = None
+
+    def full_check(self):
+        engine = self.engine
+        self.wrong = dict()
+        self.num_wrong = 0
+        for node in engine.nodes:
+            node.routing_table.track_metric_changes()
+            node.routing_table.pop_metric_changes()
+        if np is not None and engine.nodes:
+            self.full_check_vectorized()
+            return
+        dst_ids = [node.node_id for node in engine.nodes]
+        for node in engine.nodes:
+            routes_dict = node.routing_table.routes_dict
+            distances = self.ground_truth.get_distances(node.node_id)
+            wrong = {dst_id for dst_id in dst_ids if not is_route_correct(routes_dict,dst_id,distances)}
+            self.wrong[node.node_id] = wrong
+            self.num_wrong += len(wrong)
+
+    def full_check_vectorized(self):
+        # is_route_correct for a block of tables at once: the metrics are
+        # read into a node x destination matrix and compared with the hop
+        # counts
+        nodes,node_ids,matrix = self.ground_truth.get_distance_matrix()
+        num_nodes = len(nodes)
+        unreachable = np.iinfo(matrix.dtype).max
+        outside = int(node_ids.max())+1
+        index_of = np.full(outside+1,-1,dtype=np.int64)
+        index_of[node_ids] = np.arange(num_nodes)
+        for start in range(0,num_nodes,ROWS_PER_BLOCK):
+            block = nodes[start:start+ROWS_PER_BLOCK]
+            metrics = np.full((len(block),num_nodes),INVALID_METRIC,dtype=np.int64)
+            for i,node in enumerate(block):
+                dst_ids,next_hops,route_metrics = get_route_columns(node.routing_table)
+                columns = index_of[np.minimum(dst_ids,outside)]
+                inside = columns >= 0
+                metrics[i,columns[inside]] = route_metrics[inside]
+            expected = matrix[start:start+len(block)]
+            correct = np.where(expected == unreachable,metrics >= INVALID_METRIC,metrics == expected)
+            for node,row in zip(block,correct):
+                wrong = set(node_ids[~row].tolist())
+                self.wrong[node.node_id] = wrong
+                self.num_wrong += len(wrong)
+
+    def incremental_check(self):
+        for node in self.engine.nodes:
+            routing_table = node.routing_table
+            if not routing_table.changed_metrics:
+                continue
+            routes_dict = routing_table.routes_dict
+            distances = self.ground_truth.get_distances(node.node_id)
+            wrong = self.wrong[node.node_id]
+            for dst_id in routing_table.pop_metric_changes():
+                if is_route_correct(routes_dict,dst_id,distances):
+                    if dst_id in wrong:
+                        wrong.remove(dst_id)
+                        self.num_wrong -= 1
+                elif dst_id not in wrong:
+                    wrong.add(dst_id)
+                    self.num_wrong += 1
+
+    def check(self):
+        if not self.topology_version == self.engine.topology_version:
+            self.topology_version = self.engine.topology_version
+            self.full_check()
+        else:
+            self.incremental_check()
+
+        if self.num_wrong == 0:
+            if self.convergence_tick is None:
+                self.convergence_tick = self.engine.tick
+                self.convergence_messages = get_message_count(self.engine)
+            return True
+        self.convergence_tick = None
+        self.convergence_messages = None
+        return False
+
+    def get_correctness(self):
+        num_entries = len(self.engine.nodes)**2
+        return 1.0-self.num_wrong/num_entries if num_entries else 1.0
+
+
+def run_until_converged(engine, max_ticks, checker=None, check_every=1):
+    # steps the engine until every table matches the ground truth or
+    # max_ticks have passed, returns the checker with the convergence tick
+    checker = checker or ConvergenceChecker(engine)
+    if checker.check():
+        return checker
+    for tick in range(max_ticks):
+        engine.step()
+        if (tick+1)%check_every == 0 and checker.check():
+            break
+    else:
+        checker.check()
+    return checker
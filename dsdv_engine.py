@@ -0,0 +1,572 @@
+import random
+import math
+import json
+import time
+import argparse
+from collections import namedtuple
+from types import MappingProxyType
+
+from dsdv_spatial import SpatialGrid, find_pairs_within
+from dsdv_topology import TOPOLOGIES, generate_positions
+from dsdv_routing import ROUTING_TABLE_BACKENDS
+from dsdv_mobility import MobilityModel, MOBILITY_MODELS
+from dsdv_medium import Medium, MEDIUMS
+
+MESSAGE_MODES = ("snapshot","json")
+SCHEDULERS = ("tick","event")
+# "shared": one random stream for everything, "per_node": the nodes' own
+# draws (seq number, update jitter) come from a stream per node, so they do
+# not depend on which other nodes draw in between (see dsdv_sharded)
+RNG_STREAMS = ("shared","per_node")
+
+# a broadcast in "snapshot" mode, the routing_table is a read-only mapping
+# {dst_id: (next_hop, metric, seq)} shared by every receiver in range
+Packet = namedtuple("Packet", ["src_id","routing_table"])
+
+# nominal wire size used for the traffic statistics: src_id header plus
+# (dst_id, next_hop, metric, seq) as 32 bit integers per advertised route
+PACKET_HEADER_BYTES = 4
+ROUTE_ENTRY_BYTES = 16
+
+def packet_bytes(num_entries):
+    return PACKET_HEADER_BYTES + num_entries*ROUTE_ENTRY_BYTES
+
+MASK_64 = (1<<64)-1
+
+def mix_64(x):
+    # splitmix64 finaliser, a well mixed 64 bit value for every input
+    x = (x+0x9E3779B97F4A7C15) & MASK_64
+    x = ((x^(x >> 30))*0xBF58476D1CE4E5B9) & MASK_64
+    x = ((x^(x >> 27))*0x94D049BB133111EB) & MASK_64
+    return x^(x >> 31)
+
+def stream_randint(key, node_id, draw, a, b):
+    # the draw-th value in [a, b] of node_id's stream, a pure function of its arguments
+    return a+mix_64(mix_64(key^mix_64(node_id))+draw)%(b-a+1)
+
+class Node(object):
+    __slots__ = ("engine","cor_x","cor_y","tx_range","node_id","edges","neighbours","routing_table",
+                 "periodic_update_range","periodic_update_delay","periodic_update_counter","last_full_dump_tick","update_triggered",
+                 "rng_draws")
+
+    def __init__(self, engine, cor_x, cor_y, tx_range, node_id):
+        self.engine = engine
+        self.cor_x = cor_x
+        self.cor_y = cor_y
+        self.tx_range = tx_range
+        self.node_id = node_id
+
+        self.edges = []
+        self.neighbours = dict()
+        # values drawn from the node's own stream, rng_streams="per_node" only
+        self.rng_draws = 0
+
+        self.routing_table = engine.routing_table_class(self)
+
+#        self.periodic_update_range = (10,20) # using iteration_step-button
+        self.periodic_update_range = (0,5)
+        self.periodic_update_delay = engine.node_periodic_update_delay
+        self.reset_periodic_update_counter()
+
+        self.last_full_dump_tick = None
+        self.update_triggered = False
+
+    def reset_periodic_update_counter(self):
+        self.periodic_update_counter = self.periodic_update_delay + self.engine.node_randint(self,*self.periodic_update_range)
+
+    def get_distance(self, posxy):
+        x,y = posxy
+        return math.hypot(self.cor_x-x,self.cor_y-y)
+
+    def update_step(self):
+        self.check_neighbours()
+
+        if self.periodic_update_counter == 0:
+            self.broadcast_update()
+        self.periodic_update_counter -= 1
+
+    def broadcast_update(self):
+        full_dump = self.is_full_dump_due()
+        send_dict = self.routing_table.get_send_dict(full=full_dump)
+        message = self.encode_packet(send_dict)
+        self.engine.record_broadcast(full_dump,len(send_dict),len(self.routing_table.routes_dict),self.update_triggered,message)
+        self.update_triggered = False
+        self.send(message)
+        self.reset_periodic_update_counter()
+
+    def is_full_dump_due(self):
+        # between full dumps (at most every full_dump_interval ticks) only deltas are shipped
+        full_dump_interval = self.engine.full_dump_interval
+        if full_dump_interval is None:
+            return True
+        if self.last_full_dump_tick is None or self.engine.tick-self.last_full_dump_tick >= full_dump_interval:
+            self.last_full_dump_tick = self.engine.tick
+            return True
+        return False
+
+    def encode_packet(self, send_dict):
+        if self.engine.message_mode == "json":
+            packet = dict()
+            packet["src_id"] = self.node_id
+            packet["routing_table"] = dict(send_dict.items())
+            return json.dumps(packet)
+        if isinstance(send_dict, dict):
+            send_dict = MappingProxyType(send_dict)
+        return Packet(self.node_id,send_dict)
+
+    def decode_packet(self, message):
+        if self.engine.message_mode == "json":
+            packet = json.loads(message)
+            return packet["src_id"],self.routing_table.recv_string_decode(packet["routing_table"])
+        return message
+
+    def routing_table_access(self, routing_table):
+        metrics = self.engine.metrics
+        if metrics is not None:
+            return metrics.timed_table_update(self.routing_table,routing_table,self.engine.tick)
+        return self.routing_table.update(routing_table,self.engine.tick)
+
+    def send(self,message):
+        self.routing_table.increase_seq_number()
+        self.engine.medium_access(self,message,self.tx_range)
+
+    def receive(self,message):
+        src_node,routing_table = self.decode_packet(message)
+        self.neighbours[src_node] = self.engine.tick
+
+        broadcast = self.routing_table_access(routing_table)
+
+        if broadcast:
+            self.engine.trigger_update(self)
+
+    def check_neighbours(self):
+        time_now = self.engine.tick
+        lost_neighbours = []
+        for k in self.neighbours.keys():
+            if time_now-self.neighbours[k] > 2.5*self.periodic_update_delay:
+                lost_neighbours.append(k)
+        self.routing_table.set_lost_neighbours(lost_neighbours)
+        return lost_neighbours
+
+    def expire_neighbour(self, src_id):
+        # link-down: the next check_neighbours treats src_id as timed out
+        if src_id in self.neighbours:
+            self.neighbours[src_id] = min(self.neighbours[src_id],self.engine.tick-int(2.5*self.periodic_update_delay)-1)
+
+
+class Edge(object):
+    __slots__ = ("n1","n2")
+
+    def __init__(self, n1, n2):
+        self.n1 = n1
+        self.n2 = n2
+
+        self.n1.edges.append(self)
+        self.n2.edges.append(self)
+
+    def remove(self):
+        self.n1.edges.remove(self)
+        self.n2.edges.remove(self)
+        return self
+
+
+class EngineObserver(object):
+    # no-op base class, renderers and other observers override what they need
+    def network_reset(self, engine):
+        pass
+
+    def node_added(self, node):
+        pass
+
+    def node_moved(self, node):
+        pass
+
+    def edge_added(self, edge):
+        pass
+
+    def edge_removed(self, edge):
+        pass
+
+    def neighbour_expired(self, node, src_id):
+        pass
+
+    def node_transmitted(self, node):
+        pass
+
+    def transmission_delivered(self, send_node):
+        pass
+
+    def transmission_received(self, send_node, receivers):
+        pass
+
+    def half_step_finished(self, engine, step_type):
+        pass
+
+
+class Engine(object):
+    def __init__(self, width, height, message_mode="snapshot", full_dump_interval=None, routing_table_backend="dict", topology="poisson_disk", mobility=None, seed=None, rng_streams="shared", medium=None):
+        if message_mode not in MESSAGE_MODES:
+            raise ValueError("unknown message_mode {!r}, expected one of {}".format(message_mode,MESSAGE_MODES))
+        if routing_table_backend not in ROUTING_TABLE_BACKENDS:
+            raise ValueError("unknown routing_table_backend {!r}, expected one of {}".format(routing_table_backend,tuple(ROUTING_TABLE_BACKENDS)))
+        if topology not in TOPOLOGIES:
+            raise ValueError("unknown topology {!r}, expected one of {}".format(topology,tuple(TOPOLOGIES)))
+        if rng_streams not in RNG_STREAMS:
+            raise ValueError("unknown rng_streams {!r}, expected one of {}".format(rng_streams,RNG_STREAMS))
+        if full_dump_interval is not None and full_dump_interval < 1:
+            raise ValueError("full_dump_interval must be None or >= 1, got {!r}".format(full_dump_interval))
+        if isinstance(mobility, str) and mobility not in MOBILITY_MODELS:
+            raise ValueError("unknown mobility {!r}, expected one of {}".format(mobility,tuple(MOBILITY_MODELS)))
+        if not (mobility is None or isinstance(mobility, (str, MobilityModel))):
+            raise ValueError("mobility must be None, a name or a MobilityModel, got {!r}".format(mobility))
+        if isinstance(medium, str) and medium not in MEDIUMS:
+            raise ValueError("unknown medium {!r}, expected one of {}".format(medium,tuple(MEDIUMS)))
+        if not (medium is None or isinstance(medium, (str, Medium))):
+            raise ValueError("medium must be None, a name or a Medium, got {!r}".format(medium))
+        self.width = width
+        self.height = height
+        # every random decision of the simulation (seq numbers, update
+        # jitter, topology, mobility) is drawn from rng; without a seed it is
+        # the global random module, as before
+        self.seed = seed
+        self.rng = random if seed is None else random.Random(seed)
+        self.rng_streams = rng_streams
+        # keys the per node streams, unseeded runs get a random one
+        self.rng_key = None
+        if rng_streams == "per_node":
+            self.rng_key = seed if seed is not None else self.rng.getrandbits(64)
+        self.message_mode = message_mode
+        self.routing_table_backend = routing_table_backend
+        self.routing_table_class = ROUTING_TABLE_BACKENDS[routing_table_backend]
+        # in ticks, None: every broadcast is a full dump (no incremental updates)
+        self.full_dump_interval = full_dump_interval
+
+        self.node_margin = 15
+        self.node_tx_range = 100
+        self.node_min_distance = 60
+        self.node_at_most_one_max_distance = 100
+        self.node_periodic_update_delay = 5
+        self.topology = topology
+        if isinstance(mobility, str):
+            mobility = MOBILITY_MODELS[mobility](rng=self.rng)
+        self.mobility = mobility
+        # None: the unit disk, every node in range receives every broadcast
+        if medium is None:
+            medium = "unit_disk"
+        if isinstance(medium, str):
+            medium = MEDIUMS[medium](rng=self.rng)
+        self.medium = medium
+        # edge changes from move_nodes expire neighbours and trigger updates
+        # right away instead of waiting for the neighbour timeout
+        self.link_notifications = True
+
+        self.observers = []
+        # a Metrics instance while instrumentation is enabled, see dsdv_metrics
+        self.metrics = None
+        # bumped whenever the connectivity can have changed
+        self.topology_version = 0
+
+        self.reset_network()
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        self.observers.remove(observer)
+
+    def reset_network(self):
+        self.nodes = []
+        # insertion ordered set of edges, O(1) removal for moving nodes
+        self.edges = dict()
+        self.medium_transmission_buffer = []
+        self.spatial_grid = SpatialGrid(self.node_tx_range)
+        self.topology_version += 1
+        self.tick = 0
+        self.update_step_type = 0
+        self.stats = {"full_dumps": 0, "incremental_updates": 0, "triggered_updates": 0, "bytes_sent": 0, "bytes_saved": 0,
+                      "bytes_serialized": 0, "receptions": 0, "losses": 0, "collisions": 0, "links_up": 0, "links_down": 0}
+        if self.mobility is not None:
+            self.mobility.reset()
+        for observer in self.observers:
+            observer.network_reset(self)
+
+    def initialise_network(self, number_nodes, topology=None):
+        self.reset_network()
+        self.number_nodes = number_nodes
+        if topology is not None:
+            self.topology = topology
+
+        self.create_random_nodes()
+        self.connect_nodes()
+
+    def set_periodic_update_delay_for_nodes(self,delay):
+        for node in self.nodes:
+            node.periodic_update_delay = delay
+
+    def add_node(self,cor_x,cor_y,node_id):
+        new_node = Node(self, cor_x, cor_y, self.node_tx_range, node_id)
+        self.nodes.append(new_node)
+        self.spatial_grid.insert(new_node)
+        self.topology_version += 1
+        for observer in self.observers:
+            observer.node_added(new_node)
+        return new_node
+
+    def add_edge(self,n1,n2):
+        new_edge = Edge(n1,n2)
+        self.edges[new_edge] = None
+        for observer in self.observers:
+            observer.edge_added(new_edge)
+        return new_edge
+
+    def remove_edge(self,edge):
+        edge.remove()
+        del self.edges[edge]
+        for observer in self.observers:
+            observer.edge_removed(edge)
+
+    def generate_node_positions(self, number_nodes):
+        return generate_positions(self.topology, number_nodes, self.width, self.height,
+                                  min_distance=self.node_min_distance, max_distance=self.node_at_most_one_max_distance,
+                                  margin=self.node_margin, rng=self.rng)
+
+    def create_random_nodes(self):
+        positions = self.generate_node_positions(self.number_nodes)
+        for node_id,(cor_x,cor_y) in enumerate(positions):
+            self.add_node(cor_x,cor_y,node_id)
+
+    def connect_nodes(self):
+        for edge in list(self.edges):
+            self.remove_edge(edge)
+        xs = [node.cor_x for node in self.nodes]
+        ys = [node.cor_y for node in self.nodes]
+        # an edge is a link: both nodes are within each other's tx_range
+        for n1_i,n2_i in find_pairs_within(xs,ys,self.node_tx_range):
+            self.add_edge(self.nodes[n1_i],self.nodes[n2_i])
+
+    def nodes_in_range(self, cor_x, cor_y, radius):
+        return self.spatial_grid.query(cor_x,cor_y,radius)
+
+    def move_node(self, node, cor_x, cor_y):
+        self.move_nodes([(node,cor_x,cor_y)])
+
+    def move_nodes(self, moves):
+        # moves: iterable of (node, cor_x, cor_y). Only the moved nodes'
+        # neighbourhoods are re-evaluated, edges are kept instead of rebuilt
+        moved = []
+        for node,cor_x,cor_y in moves:
+            node.cor_x,node.cor_y = cor_x,cor_y
+            self.spatial_grid.move(node)
+            moved.append(node)
+        if not moved:
+            return
+        self.topology_version += 1
+        for observer in self.observers:
+            for node in moved:
+                observer.node_moved(node)
+
+        links_up = []
+        links_down = []
+        for node in moved:
+            self.update_node_edges(node,links_up,links_down)
+        for n1,n2 in links_down:
+            self.link_down(n1,n2)
+        for n1,n2 in links_up:
+            self.link_up(n1,n2)
+
+    def update_node_edges(self, node, links_up, links_down):
+        edges = {(edge.n2 if edge.n1 is node else edge.n1): edge for edge in node.edges}
+        in_range = [n2 for n2 in self.nodes_in_range(node.cor_x,node.cor_y,self.node_tx_range) if not n2 is node]
+        in_range_set = set(in_range)
+        for n2,edge in edges.items():
+            if n2 not in in_range_set:
+                self.remove_edge(edge)
+                links_down.append((node,n2))
+        for n2 in in_range:
+            if n2 not in edges:
+                self.add_edge(node,n2)
+                links_up.append((node,n2))
+
+    def link_down(self, n1, n2):
+        self.stats["links_down"] += 1
+        if not self.link_notifications:
+            return
+        for node,other in ((n1,n2),(n2,n1)):
+            if other.node_id in node.neighbours:
+                self.expire_neighbour(node,other.node_id)
+                self.trigger_update(node)
+
+    def link_up(self, n1, n2):
+        # new neighbours advertise their tables instead of waiting for the period
+        self.stats["links_up"] += 1
+        if not self.link_notifications:
+            return
+        self.trigger_update(n1)
+        self.trigger_update(n2)
+
+    def expire_neighbour(self, node, src_id):
+        node.expire_neighbour(src_id)
+        for observer in self.observers:
+            observer.neighbour_expired(node,src_id)
+
+    def node_randint(self, node, a, b):
+        if self.rng_key is None:
+            return self.rng.randint(a,b)
+        node.rng_draws += 1
+        return stream_randint(self.rng_key,node.node_id,node.rng_draws,a,b)
+
+    def record_broadcast(self, full_dump, num_entries, table_size, triggered=False, message=None):
+        if triggered:
+            self.stats["triggered_updates"] += 1
+        if isinstance(message, str):
+            self.stats["bytes_serialized"] += len(message)
+        if full_dump:
+            self.stats["full_dumps"] += 1
+        else:
+            self.stats["incremental_updates"] += 1
+        self.stats["bytes_sent"] += packet_bytes(num_entries)
+        self.stats["bytes_saved"] += (table_size-num_entries)*ROUTE_ENTRY_BYTES
+
+    def trigger_update(self, node):
+        # the node broadcasts in the next step instead of waiting for its period
+        node.periodic_update_counter = 0
+        node.update_triggered = True
+
+    def medium_access(self, send_node,message,tx_range):
+        for observer in self.observers:
+            observer.node_transmitted(send_node)
+        self.medium_transmission_buffer.append((send_node,message,tx_range))
+
+    def update_medium_transmissions(self):
+        transmissions = self.medium_transmission_buffer
+        for transmission,receivers in zip(transmissions,self.medium.get_receivers(self,transmissions)):
+            send_node,message,tx_range = transmission
+            for observer in self.observers:
+                observer.transmission_delivered(send_node)
+            for node in receivers:
+                node.receive(message)
+            self.stats["receptions"] += len(receivers)
+            for observer in self.observers:
+                observer.transmission_received(send_node,receivers)
+        self.medium_transmission_buffer = []
+
+    def update_step(self):
+        step_type = self.update_step_type
+
+        metrics = self.metrics
+        if metrics is not None:
+            start_time = time.perf_counter()
+
+        if self.update_step_type == 0:
+            for node in self.nodes:
+                node.update_step()
+            self.update_step_type = 1
+            if metrics is not None:
+                metrics.add_time("update_step",time.perf_counter()-start_time)
+
+        elif self.update_step_type == 1:
+            self.update_medium_transmissions()
+            if metrics is not None:
+                metrics.add_time("update_medium_transmissions",time.perf_counter()-start_time)
+            # nodes move between ticks, after this tick's deliveries
+            if self.mobility is not None:
+                self.mobility.step(self)
+            self.tick += 1
+            self.update_step_type = 0
+
+        for observer in self.observers:
+            observer.half_step_finished(self, step_type)
+
+    def step(self):
+        self.update_step()
+        while self.update_step_type != 0:
+            self.update_step()
+
+    def run(self, ticks):
+        for _ in range(ticks):
+            self.step()
+
+
+
+def create_engine(width, height, scheduler="tick", **kwargs):
+    if scheduler == "event":
+        from dsdv_events import EventEngine
+        return EventEngine(width,height,**kwargs)
+    if not scheduler == "tick":
+        raise ValueError("unknown scheduler {!r}, expected one of {}".format(scheduler,SCHEDULERS))
+    return Engine(width,height,**kwargs)
+
+
+def add_engine_arguments(parser):
+    parser.add_argument("--width", type=int, default=1100)
+    parser.add_argument("--height", type=int, default=800)
+    parser.add_argument("--message-mode", choices=MESSAGE_MODES, default="snapshot")
+    parser.add_argument("--full-dump-interval", type=int, default=None, help="enable incremental updates, full dump at most every N ticks")
+    parser.add_argument("--routing-table-backend", choices=tuple(ROUTING_TABLE_BACKENDS), default="dict")
+    parser.add_argument("--scheduler", choices=SCHEDULERS, default="tick")
+    parser.add_argument("--topology", choices=tuple(TOPOLOGIES), default="poisson_disk")
+    parser.add_argument("--mobility", choices=tuple(MOBILITY_MODELS), default=None)
+    parser.add_argument("--medium", choices=tuple(MEDIUMS), default="unit_disk")
+    parser.add_argument("--rng-streams", choices=RNG_STREAMS, default="shared", help="per_node: results as with dsdv_sharded.py")
+
+
+def get_engine_kwargs(args):
+    return {"message_mode": args.message_mode, "full_dump_interval": args.full_dump_interval,
+            "routing_table_backend": args.routing_table_backend, "scheduler": args.scheduler,
+            "topology": args.topology, "mobility": args.mobility, "rng_streams": args.rng_streams, "medium": args.medium}
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="headless DSDV simulation")
+    parser.add_argument("--nodes", type=int, default=100)
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--until-converged", action="store_true", help="stop as soon as all tables are correct, --ticks is the maximum")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--trace", default=None, help="record the run into this trace file")
+    parser.add_argument("--checkpoint", default=None, help="save the simulation state into this file at the end")
+    parser.add_argument("--checkpoint-every", type=int, default=None, help="and every N ticks while running")
+    parser.add_argument("--metrics", default=None, help="write the per-tick metrics time series (.csv, .json or .parquet)")
+    add_engine_arguments(parser)
+    args = parser.parse_args()
+
+    engine = create_engine(args.width,args.height,seed=args.seed,**get_engine_kwargs(args))
+    if args.trace is not None:
+        from dsdv_trace import TraceRecorder
+        recorder = TraceRecorder(engine,args.trace)
+    engine.initialise_network(args.nodes)
+    if args.metrics is not None:
+        from dsdv_metrics import Metrics
+        metrics = Metrics(engine)
+
+    start_time = time.time()
+    if args.until_converged:
+        from dsdv_convergence import run_until_converged
+        checker = run_until_converged(engine,args.ticks)
+    elif args.checkpoint_every and args.checkpoint is not None:
+        from dsdv_checkpoint import save_checkpoint
+        for tick in range(args.ticks):
+            engine.step()
+            if (tick+1)%args.checkpoint_every == 0:
+                save_checkpoint(engine,args.checkpoint)
+    else:
+        engine.run(args.ticks)
+    duration = time.time()-start_time
+    if args.trace is not None:
+        recorder.close()
+    if args.checkpoint is not None:
+        from dsdv_checkpoint import save_checkpoint
+        save_checkpoint(engine,args.checkpoint)
+
+    print("{} nodes, {} ticks in {:.3f}s ({:.1f} ticks/s)".format(len(engine.nodes),engine.tick,duration,engine.tick/max(duration,1e-9)))
+    if args.until_converged:
+        if checker.convergence_tick is None:
+            print("not converged, {:.4f} of the routes correct".format(checker.get_correctness()))
+        else:
+            print("converged at tick {} after {} messages".format(checker.convergence_tick,checker.convergence_messages))
+    print("{full_dumps} full dumps, {incremental_updates} incremental updates, {bytes_sent} bytes sent, {bytes_saved} bytes saved".format(**engine.stats))
+    if engine.stats["losses"] or engine.stats["collisions"]:
+        print("{receptions} receptions, {losses} lost, {collisions} collided".format(**engine.stats))
+    if args.metrics is not None:
+        print(metrics.summary())
+        metrics.write_time_series(args.metrics)
@@ -0,0 +1,227 @@
+import heapq
+import math
+import time
+
+from dsdv_engine import Engine
+
+# event kinds, also the order of events scheduled for the same time:
+# neighbour checks and sends of tick t happen before any delivery at t
+CHECK_NEIGHBOURS = 0
+SEND_UPDATE = 1
+TRANSMISSION = 2
+DELIVERY = 3
+
+class EventScheduler(object):
+    def __init__(self):
+        self.queue = []
+        self.counter = 0
+
+    def schedule(self, time, kind, order_key, *args):
+        # order_key keeps the tick engine's iteration order among equal times
+        heapq.heappush(self.queue, (time, kind, order_key, self.counter, args))
+        self.counter += 1
+
+    def peek_time(self):
+        return self.queue[0][0]
+
+    def pop(self):
+        time,kind,order_key,counter,args = heapq.heappop(self.queue)
+        return time,kind,args
+
+    def __len__(self):
+        return len(self.queue)
+
+
+class EventEngine(Engine):
+    # Engine driven by a heap of timestamped events instead of visiting every
+    # node and edge each tick. Sends happen on integer ticks, a transmission
+    # reaches the medium propagation_delay later and, with a finite
+    # propagation_speed, each receiver another distance/propagation_speed
+    # later. With the defaults the resulting tables are identical to Engine.
+    def __init__(self, width, height, propagation_delay=0.5, propagation_speed=None, **kwargs):
+        if propagation_delay <= 0:
+            raise ValueError("propagation_delay must be > 0, got {!r}".format(propagation_delay))
+        self.propagation_delay = propagation_delay
+        self.propagation_speed = propagation_speed
+        self.scheduler = EventScheduler()
+        super().__init__(width,height,**kwargs)
+        self.handlers = {CHECK_NEIGHBOURS: self.handle_check_neighbours,
+                         SEND_UPDATE: self.handle_send_update,
+                         TRANSMISSION: self.handle_transmission,
+                         DELIVERY: self.handle_delivery}
+
+    def reset_network(self):
+        self.scheduler = EventScheduler()
+        self.now = 0
+        self.transmission_counter = 0
+        self.next_send_times = dict()
+        self.neighbour_timeouts = dict()
+        self.neighbour_checks = dict()
+        self.nodes_with_lost_neighbours = set()
+        self.transmission_batch = []
+        super().reset_network()
+        self.stats["events"] = 0
+
+    def add_node(self,cor_x,cor_y,node_id):
+        new_node = super().add_node(cor_x,cor_y,node_id)
+        self.schedule_send_update(new_node,self.tick+new_node.periodic_update_counter)
+        return new_node
+
+    def set_periodic_update_delay_for_nodes(self,delay):
+        super().set_periodic_update_delay_for_nodes(delay)
+        # neighbours may already count as lost in the next check_neighbours round
+        check_tick = self.tick if self.update_step_type == 0 else self.tick+1
+        for node in self.nodes:
+            self.schedule_check_neighbours(node,check_tick)
+            for src_id in node.neighbours.keys():
+                self.schedule_neighbour_timeout(node,src_id)
+
+# ---- scheduling ----
+
+    def schedule_send_update(self, node, time):
+        # a counter <= 0 never reaches 0 again in the tick engine either
+        if time <= self.now:
+            return
+        pending = self.next_send_times.get(node)
+        if pending is None or time < pending:
+            self.next_send_times[node] = time
+            self.scheduler.schedule(time, SEND_UPDATE, node.node_id, node)
+
+    def trigger_update(self, node):
+        super().trigger_update(node)
+        self.schedule_send_update(node,int(math.floor(self.now))+1)
+
+    def get_neighbour_expiry(self, node, heard_time):
+        # first tick at which check_neighbours considers the neighbour lost
+        return int(math.floor(heard_time+2.5*node.periodic_update_delay))+1
+
+    def schedule_neighbour_timeout(self, node, src_id):
+        expiry = self.get_neighbour_expiry(node,node.neighbours[src_id])
+        if expiry <= self.tick:
+            return
+        key = (node,src_id)
+        pending = self.neighbour_timeouts.get(key)
+        if pending is None or expiry < pending:
+            self.neighbour_timeouts[key] = expiry
+            self.scheduler.schedule(expiry, CHECK_NEIGHBOURS, node.node_id, node, src_id)
+
+    def schedule_check_neighbours(self, node, time):
+        if not self.neighbour_checks.get(node) == time:
+            self.neighbour_checks[node] = time
+            self.scheduler.schedule(time, CHECK_NEIGHBOURS, node.node_id, node, None)
+
+    def expire_neighbour(self, node, src_id):
+        super().expire_neighbour(node,src_id)
+        check_tick = self.tick if self.update_step_type == 0 else self.tick+1
+        self.schedule_check_neighbours(node,check_tick)
+
+    def medium_access(self, send_node,message,tx_range):
+        for observer in self.observers:
+            observer.node_transmitted(send_node)
+        self.scheduler.schedule(self.now+self.propagation_delay, TRANSMISSION, self.transmission_counter, send_node, message, tx_range, self.transmission_counter)
+        self.transmission_counter += 1
+
+# ---- event handlers ----
+
+    def handle_check_neighbours(self, node, src_id):
+        if src_id is not None:
+            key = (node,src_id)
+            if not self.neighbour_timeouts.get(key) == self.now:
+                return
+            del self.neighbour_timeouts[key]
+            if self.get_neighbour_expiry(node,node.neighbours[src_id]) > self.tick:
+                # heard again since the timeout was scheduled
+                self.schedule_neighbour_timeout(node,src_id)
+                return
+        elif self.neighbour_checks.get(node) == self.now:
+            del self.neighbour_checks[node]
+        if node.check_neighbours():
+            self.nodes_with_lost_neighbours.add(node)
+        else:
+            self.nodes_with_lost_neighbours.discard(node)
+
+    def handle_send_update(self, node):
+        if not self.next_send_times.get(node) == self.now:
+            return
+        del self.next_send_times[node]
+        node.broadcast_update()
+        self.schedule_send_update(node,self.tick+node.periodic_update_counter)
+
+    def handle_transmission(self, send_node, message, tx_range, transmission_id):
+        # the medium gets all transmissions of the same time at once, they
+        # are collected until the last of them is popped
+        self.transmission_batch.append((send_node,message,tx_range,transmission_id))
+        queue = self.scheduler.queue
+        if queue and queue[0][0] == self.now and queue[0][1] == TRANSMISSION:
+            return
+        batch = self.transmission_batch
+        self.transmission_batch = []
+        receivers_per_transmission = self.medium.get_receivers(self,[(send_node,message,tx_range) for send_node,message,tx_range,transmission_id in batch])
+        for (send_node,message,tx_range,transmission_id),receivers in zip(batch,receivers_per_transmission):
+            for observer in self.observers:
+                observer.transmission_delivered(send_node)
+            if self.propagation_speed is None:
+                for node in receivers:
+                    self.deliver(send_node,message,node)
+                self.stats["receptions"] += len(receivers)
+                for observer in self.observers:
+                    observer.transmission_received(send_node,receivers)
+            else:
+                for node in receivers:
+                    delay = node.get_distance((send_node.cor_x,send_node.cor_y))/self.propagation_speed
+                    self.scheduler.schedule(self.now+delay, DELIVERY, transmission_id, send_node, message, node)
+
+    def handle_delivery(self, send_node, message, node):
+        self.deliver(send_node,message,node)
+        self.stats["receptions"] += 1
+        for observer in self.observers:
+            observer.transmission_received(send_node,[node])
+
+    def deliver(self, send_node, message, node):
+        node.receive(message)
+        self.schedule_neighbour_timeout(node,send_node.node_id)
+        if node in self.nodes_with_lost_neighbours:
+            # set_lost_neighbours runs every tick in Engine, re-apply it
+            # to routes that this update may have re-installed
+            self.schedule_check_neighbours(node,self.tick+1)
+
+# ---- stepping ----
+
+    def process_events(self, time_limit):
+        scheduler = self.scheduler
+        handlers = self.handlers
+        while scheduler and scheduler.peek_time() < time_limit:
+            time,kind,args = scheduler.pop()
+            self.now = time
+            self.tick = int(math.floor(time))
+            self.stats["events"] += 1
+            handlers[kind](*args)
+
+    def update_step(self):
+        step_type = self.update_step_type
+        tick = self.tick
+
+        metrics = self.metrics
+        if metrics is not None:
+            start_time = time.perf_counter()
+
+        if self.update_step_type == 0:
+            self.process_events(tick+0.5)
+            self.tick = tick
+            self.update_step_type = 1
+            if metrics is not None:
+                metrics.add_time("update_step",time.perf_counter()-start_time)
+
+        elif self.update_step_type == 1:
+            self.process_events(tick+1)
+            if metrics is not None:
+                metrics.add_time("update_medium_transmissions",time.perf_counter()-start_time)
+            if self.mobility is not None:
+                self.tick = tick
+                self.mobility.step(self)
+            self.tick = tick+1
+            self.now = self.tick
+            self.update_step_type = 0
+
+        for observer in self.observers:
+            observer.half_step_finished(self, step_type)
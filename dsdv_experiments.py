@@ -0,0 +1,78 @@
+import argparse
+import csv
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from dsdv_engine import create_engine, add_engine_arguments, get_engine_kwargs
+from dsdv_convergence import run_until_converged, get_message_count
+
+RESULT_FIELDS = ["num_nodes","periodic_update_delay","tx_range","seed","ticks","converged","convergence_tick",
+                 "messages","bytes_sent","table_correctness","wall_time"]
+
+def run_experiment(params):
+    num_nodes,periodic_update_delay,tx_range,seed,ticks,check_every,width,height,engine_kwargs = params
+    engine = create_engine(width,height,seed=seed,**engine_kwargs)
+    engine.node_tx_range = tx_range
+    engine.node_periodic_update_delay = periodic_update_delay
+    engine.initialise_network(num_nodes)
+
+    start_time = time.time()
+    checker = run_until_converged(engine,ticks,check_every=check_every)
+
+    return {"num_nodes": num_nodes,
+            "periodic_update_delay": periodic_update_delay,
+            "tx_range": tx_range,
+            "seed": seed,
+            "ticks": engine.tick,
+            "converged": checker.convergence_tick is not None,
+            "convergence_tick": checker.convergence_tick,
+            "messages": get_message_count(engine),
+            "bytes_sent": engine.stats["bytes_sent"],
+            "table_correctness": checker.get_correctness(),
+            "wall_time": time.time()-start_time}
+
+
+def write_results(results, output):
+    if output.endswith(".parquet"):
+        try:
+            import pandas
+        except ImportError:
+            raise SystemExit("writing parquet needs pandas and pyarrow, e.g.: pip install pandas pyarrow")
+        pandas.DataFrame(results, columns=RESULT_FIELDS).to_parquet(output, index=False)
+        return
+    with open(output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def run_grid(num_nodes_list, periodic_update_delays, tx_ranges, seeds, ticks, check_every=1, width=1100, height=800, workers=None, engine_kwargs=None):
+    engine_kwargs = engine_kwargs or dict()
+    grid = [(num_nodes,periodic_update_delay,tx_range,seed,ticks,check_every,width,height,engine_kwargs)
+            for num_nodes,periodic_update_delay,tx_range,seed in itertools.product(num_nodes_list,periodic_update_delays,tx_ranges,seeds)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_experiment, grid))
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run a parameter sweep of headless DSDV simulations in parallel")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[50])
+    parser.add_argument("--periodic-update-delay", type=int, nargs="+", default=[5])
+    parser.add_argument("--tx-range", type=float, nargs="+", default=[100])
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--ticks", type=int, default=200, help="maximum ticks, runs stop early at convergence")
+    parser.add_argument("--check-every", type=int, default=1, help="ticks between convergence checks")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default="results.csv", help=".csv or .parquet")
+    add_engine_arguments(parser)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    results = run_grid(args.nodes, args.periodic_update_delay, args.tx_range, args.seeds, args.ticks,
+                       check_every=args.check_every, width=args.width, height=args.height,
+                       workers=args.workers, engine_kwargs=get_engine_kwargs(args))
+    write_results(results, args.output)
+    print("{} runs in {:.1f}s written to {}".format(len(results),time.time()-start_time,args.output))
@@ -0,0 +1,156 @@
+import random
+from operator import attrgetter
+
+from dsdv_spatial import SpatialGrid, Point
+
+# A medium decides which of the nodes within tx_range of a sender receive
+# its broadcast. It gets all transmissions of a tick at once, they are sent
+# in the same phase 0 and overlap in time, so interference between them can
+# be modelled. Receptions lost on the medium are counted in engine.stats
+# ("losses", "collisions"). A sender always receives its own broadcast.
+
+get_node_id = attrgetter("node_id")
+
+class Medium(object):
+    def __init__(self, rng=random):
+        self.rng = rng
+
+    def get_receivers(self, engine, transmissions):
+        # transmissions: [(send_node, message, tx_range)], returns the list
+        # of receivers of each transmission
+        raise NotImplementedError
+
+    def get_nodes_in_range(self, engine, transmissions):
+        # sorted by node_id: the grid's bucket order depends on how the nodes
+        # moved and is not restored by a checkpoint, the random draws per
+        # receiver must not depend on it
+        query = engine.spatial_grid.query
+        return [sorted(query(send_node.cor_x,send_node.cor_y,tx_range),key=get_node_id) for send_node,message,tx_range in transmissions]
+
+
+class UnitDisk(Medium):
+    # every node in range receives every transmission
+    def get_receivers(self, engine, transmissions):
+        return self.get_nodes_in_range(engine,transmissions)
+
+
+class LossyMedium(Medium):
+    # every reception is lost independently with loss_probability
+    def __init__(self, loss_probability=0.1, rng=random):
+        super().__init__(rng)
+        self.loss_probability = loss_probability
+
+    def get_receivers(self, engine, transmissions):
+        return self.drop(engine,transmissions,self.get_nodes_in_range(engine,transmissions))
+
+    def drop(self, engine, transmissions, receivers_per_transmission):
+        if self.loss_probability <= 0:
+            return receivers_per_transmission
+        rand = self.rng.random
+        loss_probability = self.loss_probability
+        kept_per_transmission = []
+        losses = 0
+        for (send_node,message,tx_range),receivers in zip(transmissions,receivers_per_transmission):
+            kept = [node for node in receivers if node is send_node or rand() >= loss_probability]
+            losses += len(receivers)-len(kept)
+            kept_per_transmission.append(kept)
+        engine.stats["losses"] += losses
+        return kept_per_transmission
+
+
+class CsmaMedium(LossyMedium):
+    # collisions are decided per receiver: a node in range of several
+    # senders receives none of them if any two of those senders could not
+    # sense each other (hidden terminals), senders within
+    # carrier_sense_range of each other take turns and do not collide.
+    # carrier_sense_range None: each sender's tx_range, 0: every overlap
+    # collides (ALOHA). Only senders sharing a receiver are compared, the
+    # sensing is looked up in a grid of the tick's senders.
+    def __init__(self, carrier_sense_range=None, loss_probability=0.0, rng=random):
+        super().__init__(loss_probability,rng)
+        self.carrier_sense_range = carrier_sense_range
+
+    def get_receivers(self, engine, transmissions):
+        receivers_per_transmission = self.get_nodes_in_range(engine,transmissions)
+        heard = dict()
+        for i,receivers in enumerate(receivers_per_transmission):
+            for node in receivers:
+                if node in heard:
+                    heard[node].append(i)
+                else:
+                    heard[node] = [i]
+
+        sensed = dict()
+        sender_grid = None
+        # receiver -> whether the senders it hears collide there
+        collided = dict()
+        kept_per_transmission = []
+        collisions = 0
+        for i,((send_node,message,tx_range),receivers) in enumerate(zip(transmissions,receivers_per_transmission)):
+            kept = []
+            for node in receivers:
+                senders = heard[node]
+                if len(senders) > 1 and not node is send_node:
+                    if node not in collided:
+                        for j in senders:
+                            if j not in sensed:
+                                if sender_grid is None:
+                                    sender_grid = self.get_sender_grid(transmissions)
+                                sensed[j] = self.get_sensed(sender_grid,transmissions[j])
+                        collided[node] = not all(sensed[j].issuperset(senders) for j in senders)
+                    if collided[node]:
+                        collisions += 1
+                        continue
+                kept.append(node)
+            kept_per_transmission.append(kept)
+        engine.stats["collisions"] += collisions
+        return self.drop(engine,transmissions,kept_per_transmission)
+
+    def get_sender_grid(self, transmissions):
+        cell_size = self.carrier_sense_range or max(tx_range for send_node,message,tx_range in transmissions)
+        sender_grid = SpatialGrid(cell_size)
+        for i,(send_node,message,tx_range) in enumerate(transmissions):
+            sender_grid.insert(Point(send_node.cor_x,send_node.cor_y,i))
+        return sender_grid
+
+    def get_sensed(self, sender_grid, transmission):
+        # indices of the transmissions the sender senses, itself included
+        send_node,message,tx_range = transmission
+        sense_range = tx_range if self.carrier_sense_range is None else self.carrier_sense_range
+        return {point.index for point in sender_grid.query(send_node.cor_x,send_node.cor_y,sense_range)}
+
+
+MEDIUMS = {"unit_disk": UnitDisk,
+           "lossy": LossyMedium,
+           "csma": CsmaMedium}
+
+
+def check_hidden_terminals():
+    # small layouts with a receiver R in range of every sender and a
+    # carrier_sense_range of tx_range (100): name -> (sender positions,
+    # whether R receives them)
+    from dsdv_engine import Engine
+    cases = {"exposed": ([(60,0),(110,0)],True),
+             "hidden": ([(0,0),(180,0)],False),
+             # A senses B and C, but B and C are hidden from each other
+             "hidden behind a sensed sender": ([(90,0),(0,0),(180,0)],False)}
+    failed = []
+    for name,(positions,expected) in cases.items():
+        engine = Engine(400,200,medium="csma")
+        engine.reset_network()
+        receiver = engine.add_node(90,10,0)
+        senders = [engine.add_node(x,y,node_id) for node_id,(x,y) in enumerate(positions,1)]
+        transmissions = [(send_node,None,send_node.tx_range) for send_node in senders]
+        receivers_per_transmission = engine.medium.get_receivers(engine,transmissions)
+        received = [receiver in receivers for receivers in receivers_per_transmission]
+        if not received == [expected]*len(senders):
+            failed.append(name)
+        print("{}: received {}, expected {}".format(name,received,[expected]*len(senders)))
+    return failed
+
+
+if __name__ == "__main__":
+    failed = check_hidden_terminals()
+    if failed:
+        raise SystemExit("wrong receptions: "+", ".join(failed))
+    print("all hidden terminal cases ok")
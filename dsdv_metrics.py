@@ -0,0 +1,166 @@
+import csv
+import json
+import time
+
+from dsdv_engine import EngineObserver
+
+# Optional instrumentation. While disabled (engine.metrics is None) the engine
+# only pays a None check per half step and per received table. The counters
+# themselves (messages, bytes, triggered updates, receptions) are the
+# always-on engine.stats, Metrics samples their per-tick differences and adds
+# wall times and route installs measured only while it is enabled.
+
+TIMERS = ("update_step","update_medium_transmissions","routing_table_update")
+
+# (time series column, engine.stats key)
+STATS_COLUMNS = (("full_dumps","full_dumps"),
+                 ("incremental_updates","incremental_updates"),
+                 ("triggered_updates","triggered_updates"),
+                 ("bytes_sent","bytes_sent"),
+                 ("bytes_serialized","bytes_serialized"),
+                 ("receptions","receptions"),
+                 ("losses","losses"),
+                 ("collisions","collisions"))
+
+TIME_SERIES_FIELDS = (["tick","messages","periodic_updates"]+[column for column,key in STATS_COLUMNS]+
+                      ["routes_updated","routing_table_updates"]+[name+"_time" for name in TIMERS])
+
+class Histogram(object):
+    # power of two buckets: bucket i counts values in [2**(i-1), 2**i),
+    # bucket 0 the values below 1
+    def __init__(self):
+        self.buckets = []
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        bucket = int(value).bit_length() if value >= 1 else 0
+        if bucket >= len(self.buckets):
+            self.buckets.extend([0]*(bucket+1-len(self.buckets)))
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += value
+
+    def mean(self):
+        return self.total/self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {"count": self.count, "total": self.total,
+                "buckets": {"<{}".format(2**i): count for i,count in enumerate(self.buckets) if count}}
+
+
+class Metrics(EngineObserver):
+    # per-tick time series of the protocol counters and wall times plus
+    # histograms over the whole run: wall time per call in microseconds
+    # (update_step, update_medium_transmissions, routing_table_update),
+    # messages, routes updated and receptions per tick
+    def __init__(self, engine, enabled=True):
+        self.engine = engine
+        self.rows = []
+        self.histograms = {name: Histogram() for name in TIMERS+("messages","routes_updated","receptions")}
+        self.reset_tick()
+        self.last_stats = dict(engine.stats)
+        if enabled:
+            self.enable()
+
+    def reset_tick(self):
+        self.times = dict.fromkeys(TIMERS,0.0)
+        self.routes_updated = 0
+        self.routing_table_updates = 0
+
+    def enable(self):
+        if self.engine.metrics is self:
+            return
+        self.last_stats = dict(self.engine.stats)
+        self.reset_tick()
+        self.engine.metrics = self
+        self.engine.add_observer(self)
+
+    def disable(self):
+        if self.engine.metrics is not self:
+            return
+        self.engine.metrics = None
+        self.engine.remove_observer(self)
+
+    @property
+    def enabled(self):
+        return self.engine.metrics is self
+
+# ---- hooks called by the engine while enabled ----
+
+    def add_time(self, name, duration):
+        self.times[name] += duration
+        self.histograms[name].add(duration*1e6)
+
+    def timed_table_update(self, routing_table, neighbour_routing_table, updt_time):
+        route_installs = routing_table.route_installs
+        start_time = time.perf_counter()
+        broadcast = routing_table.update(neighbour_routing_table,updt_time)
+        self.add_time("routing_table_update",time.perf_counter()-start_time)
+        self.routes_updated += routing_table.route_installs-route_installs
+        self.routing_table_updates += 1
+        return broadcast
+
+    def network_reset(self, engine):
+        self.last_stats = dict(engine.stats)
+
+    def half_step_finished(self, engine, step_type):
+        if step_type == 1:
+            self.sample(engine.tick-1)
+
+# ---- time series ----
+
+    def sample(self, tick):
+        stats = self.engine.stats
+        row = {"tick": tick}
+        for column,key in STATS_COLUMNS:
+            row[column] = stats.get(key,0)-self.last_stats.get(key,0)
+        row["messages"] = row["full_dumps"]+row["incremental_updates"]
+        row["periodic_updates"] = row["messages"]-row["triggered_updates"]
+        row["routes_updated"] = self.routes_updated
+        row["routing_table_updates"] = self.routing_table_updates
+        for name in TIMERS:
+            row[name+"_time"] = self.times[name]
+        self.rows.append(row)
+
+        self.histograms["messages"].add(row["messages"])
+        self.histograms["routes_updated"].add(row["routes_updated"])
+        self.histograms["receptions"].add(row["receptions"])
+        self.last_stats = dict(stats)
+        self.reset_tick()
+        return row
+
+    def get_totals(self):
+        totals = {field: sum(row[field] for row in self.rows) for field in TIME_SERIES_FIELDS if not field == "tick"}
+        totals["ticks"] = len(self.rows)
+        return totals
+
+    def to_columns(self):
+        return {field: [row[field] for row in self.rows] for field in TIME_SERIES_FIELDS}
+
+    def write_time_series(self, output):
+        # .csv, .json (time series, totals and histograms) or .parquet
+        if output.endswith(".json"):
+            with open(output, "w") as f:
+                json.dump({"time_series": self.to_columns(), "totals": self.get_totals(),
+                           "histograms": {name: histogram.to_dict() for name,histogram in self.histograms.items()}}, f)
+            return
+        if output.endswith(".parquet"):
+            try:
+                import pandas
+            except ImportError:
+                raise SystemExit("writing parquet needs pandas and pyarrow, e.g.: pip install pandas pyarrow")
+            pandas.DataFrame(self.rows, columns=TIME_SERIES_FIELDS).to_parquet(output, index=False)
+            return
+        with open(output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=TIME_SERIES_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+    def summary(self):
+        totals = self.get_totals()
+        lines = ["{messages} messages ({triggered_updates} triggered, {periodic_updates} periodic), {routes_updated} routes updated, {receptions} receptions".format(**totals)]
+        for name in TIMERS:
+            histogram = self.histograms[name]
+            lines.append("{}: {:.3f}s in {} calls, {:.1f}us per call".format(name,histogram.total/1e6,histogram.count,histogram.mean()))
+        return "\n".join(lines)
@@ -0,0 +1,137 @@
+import math
+import random
+
+# A mobility model moves every node once per tick through
+# Engine.move_nodes, which re-evaluates only the moved nodes' neighbourhoods.
+# Positions are kept inside [margin, width-margin] x [margin, height-margin].
+
+def wrap_angle(angle):
+    # the same angle in [-pi, pi)
+    return (angle+math.pi)%(2*math.pi)-math.pi
+
+
+class MobilityModel(object):
+    def __init__(self, rng=random):
+        self.rng = rng
+        self.states = dict()
+
+    def init_state(self, engine, node):
+        raise NotImplementedError
+
+    def next_position(self, engine, node, state):
+        raise NotImplementedError
+
+    def step(self, engine):
+        moves = []
+        for node in engine.nodes:
+            state = self.states.get(node)
+            if state is None:
+                state = self.states[node] = self.init_state(engine,node)
+            cor_x,cor_y = self.next_position(engine,node,state)
+            if not (cor_x == node.cor_x and cor_y == node.cor_y):
+                moves.append((node,cor_x,cor_y))
+        engine.move_nodes(moves)
+
+    def reset(self):
+        self.states = dict()
+
+    def clamp(self, engine, cor_x, cor_y):
+        margin = engine.node_margin
+        cor_x = min(max(cor_x,margin),engine.width-margin)
+        cor_y = min(max(cor_y,margin),engine.height-margin)
+        return cor_x,cor_y
+
+
+class RandomWaypoint(MobilityModel):
+    # walk to a uniformly drawn target at a random speed, pause, repeat
+    def __init__(self, speed_range=(1.0,5.0), pause_range=(0,20), rng=random):
+        super().__init__(rng)
+        self.speed_range = speed_range
+        self.pause_range = pause_range
+
+    def new_waypoint(self, engine, state):
+        margin = engine.node_margin
+        state["target"] = (self.rng.uniform(margin,engine.width-margin),self.rng.uniform(margin,engine.height-margin))
+        state["speed"] = self.rng.uniform(*self.speed_range)
+
+    def init_state(self, engine, node):
+        state = {"pause": self.rng.randint(*self.pause_range)}
+        self.new_waypoint(engine,state)
+        return state
+
+    def next_position(self, engine, node, state):
+        if state["pause"] > 0:
+            state["pause"] -= 1
+            return node.cor_x,node.cor_y
+        target_x,target_y = state["target"]
+        distance = math.hypot(target_x-node.cor_x,target_y-node.cor_y)
+        if distance <= state["speed"]:
+            state["pause"] = self.rng.randint(*self.pause_range)
+            self.new_waypoint(engine,state)
+            return target_x,target_y
+        ratio = state["speed"]/distance
+        return node.cor_x+(target_x-node.cor_x)*ratio,node.cor_y+(target_y-node.cor_y)*ratio
+
+
+class RandomWalk(MobilityModel):
+    # constant speed, a new uniform direction every turn_interval ticks,
+    # reflected at the borders
+    def __init__(self, speed=2.0, turn_interval=10, rng=random):
+        super().__init__(rng)
+        self.speed = speed
+        self.turn_interval = turn_interval
+
+    def init_state(self, engine, node):
+        return {"direction": self.rng.uniform(0,2*math.pi), "ticks_left": self.rng.randint(1,self.turn_interval)}
+
+    def next_position(self, engine, node, state):
+        if state["ticks_left"] == 0:
+            state["direction"] = self.rng.uniform(0,2*math.pi)
+            state["ticks_left"] = self.turn_interval
+        state["ticks_left"] -= 1
+
+        margin = engine.node_margin
+        cor_x = node.cor_x+self.speed*math.cos(state["direction"])
+        cor_y = node.cor_y+self.speed*math.sin(state["direction"])
+        if not margin <= cor_x <= engine.width-margin:
+            state["direction"] = math.pi-state["direction"]
+        if not margin <= cor_y <= engine.height-margin:
+            state["direction"] = -state["direction"]
+        return self.clamp(engine,cor_x,cor_y)
+
+
+class GaussMarkov(MobilityModel):
+    # speed and direction are first order autoregressive processes,
+    # alpha = 1 is a straight line, alpha = 0 is a memoryless random walk;
+    # near the borders the mean direction points back to the centre
+    def __init__(self, alpha=0.75, mean_speed=2.0, speed_deviation=0.5, direction_deviation=0.4, rng=random):
+        super().__init__(rng)
+        self.alpha = alpha
+        self.mean_speed = mean_speed
+        self.speed_deviation = speed_deviation
+        self.direction_deviation = direction_deviation
+
+    def init_state(self, engine, node):
+        direction = self.rng.uniform(0,2*math.pi)
+        return {"speed": self.mean_speed, "direction": direction, "mean_direction": direction}
+
+    def next_position(self, engine, node, state):
+        border = 2*engine.node_at_most_one_max_distance
+        if not (border < node.cor_x < engine.width-border and border < node.cor_y < engine.height-border):
+            state["mean_direction"] = math.atan2(engine.height/2-node.cor_y,engine.width/2-node.cor_x)
+
+        alpha = self.alpha
+        noise = math.sqrt(1-alpha**2)
+        state["speed"] = max(0.0,alpha*state["speed"]+(1-alpha)*self.mean_speed+noise*self.rng.gauss(0,self.speed_deviation))
+        # blended along the shorter way round towards the mean direction
+        direction = state["direction"]+(1-alpha)*wrap_angle(state["mean_direction"]-state["direction"])+noise*self.rng.gauss(0,self.direction_deviation)
+        state["direction"] = direction%(2*math.pi)
+
+        cor_x = node.cor_x+state["speed"]*math.cos(state["direction"])
+        cor_y = node.cor_y+state["speed"]*math.sin(state["direction"])
+        return self.clamp(engine,cor_x,cor_y)
+
+
+MOBILITY_MODELS = {"random_waypoint": RandomWaypoint,
+                   "random_walk": RandomWalk,
+                   "gauss_markov": GaussMarkov}
@@ -0,0 +1,168 @@
+import itertools
+import math
+import tkinter as tk
+from collections import namedtuple
+
+from dsdv_engine import EngineObserver
+
+# Rendering in two parts: a FrameRecorder observes the engine and turns its
+# state into immutable Frames, a CanvasRenderer draws a Frame by diffing it
+# against what is already on the canvas. Only changed items are touched (one
+# coords per moved node and its edges, one itemconfigure per colour change),
+# the engine can run any number of half steps between two drawn frames.
+
+# nodes: tuple of (node_id, cor_x, cor_y, highlighted)
+# edges: tuple of (n1_id, n2_id, highlighted)
+# generation: changes with every network reset, the canvas is cleared then
+Frame = namedtuple("Frame", ("generation","tick","nodes","edges"))
+
+generations = itertools.count()
+
+class FrameRecorder(EngineObserver):
+    # the highlight state the engine doesn't keep: nodes that transmitted in
+    # the last phase 0 and edges that delivered in the last phase 1 are drawn
+    # red for one tick
+    def __init__(self, engine):
+        self.engine = engine
+        self.network_reset(engine)
+
+    def network_reset(self, engine):
+        self.generation = next(generations)
+        self.node_colorised_counters = dict()
+        self.edge_colorised_counters = dict()
+
+    def edge_removed(self, edge):
+        self.edge_colorised_counters.pop(edge,None)
+
+    def node_transmitted(self, node):
+        self.node_colorised_counters[node] = 1
+
+    def transmission_delivered(self, send_node):
+        for edge in send_node.edges:
+            self.edge_colorised_counters[edge] = 1
+
+    def half_step_finished(self, engine, step_type):
+        if step_type == 0:
+            self.decrease_colorised_counters(self.node_colorised_counters)
+        elif step_type == 1:
+            self.decrease_colorised_counters(self.edge_colorised_counters)
+
+    def decrease_colorised_counters(self, counters):
+        for item in list(counters.keys()):
+            if counters[item] == 0:
+                del counters[item]
+            else:
+                counters[item] -= 1
+
+    def frame(self):
+        engine = self.engine
+        node_colorised = self.node_colorised_counters
+        edge_colorised = self.edge_colorised_counters
+        nodes = tuple((node.node_id,node.cor_x,node.cor_y,node in node_colorised) for node in engine.nodes)
+        edges = tuple((edge.n1.node_id,edge.n2.node_id,edge in edge_colorised) for edge in engine.edges)
+        return Frame(self.generation,engine.tick,nodes,edges)
+
+
+class CanvasRenderer(object):
+    def __init__(self, canvas, node_width=30, node_fill_colour="blue", edge_fill_colour="black", highlight_colour="red"):
+        self.canvas = canvas
+        self.node_width = node_width
+        self.node_fill_colour = node_fill_colour
+        self.edge_fill_colour = edge_fill_colour
+        self.highlight_colour = highlight_colour
+        self.clear()
+
+    def clear(self):
+        self.canvas.delete("all")
+        self.generation = None
+        self.tick = None
+        # node_id -> (oval, text), (cor_x, cor_y, highlighted) as drawn
+        self.node_entities = dict()
+        self.drawn_nodes = dict()
+        # (n1_id, n2_id) -> line, highlighted as drawn
+        self.edge_entities = dict()
+        self.drawn_edges = dict()
+        # hidden lines of removed edges, reused for new ones
+        self.free_lines = []
+        self.tick_text = self.canvas.create_text(20,20, anchor=tk.NW, text="")
+
+    def get_node_coords(self, cor_x, cor_y):
+        return cor_x-self.node_width/2,cor_y-self.node_width/2,cor_x+self.node_width/2,cor_y+self.node_width/2
+
+    def get_edge_coords(self, x1, y1, x2, y2):
+        node_distance = math.hypot(x1-x2,y1-y2)
+        if node_distance == 0:
+            return x1,y1,x2,y2
+
+        begin_ratio = ((self.node_width/2)+1)/node_distance
+        end_ratio = 1-((self.node_width/2)+1)/node_distance
+
+        x1 = begin_ratio*x2+(1-begin_ratio)*x1
+        y1 = begin_ratio*y2+(1-begin_ratio)*y1
+        x2 = end_ratio*x2+(1-end_ratio)*x1
+        y2 = end_ratio*y2+(1-end_ratio)*y1
+
+        return x1,y1,x2,y2
+
+    def draw(self, frame):
+        if frame.generation != self.generation:
+            self.clear()
+            self.generation = frame.generation
+        canvas = self.canvas
+
+        moved = set()
+        drawn_nodes = self.drawn_nodes
+        for node in frame.nodes:
+            node_id,cor_x,cor_y,highlighted = node
+            drawn = drawn_nodes.get(node_id)
+            if drawn == node[1:]:
+                continue
+            fill = self.highlight_colour if highlighted else self.node_fill_colour
+            if drawn is None:
+                entity = canvas.create_oval(*self.get_node_coords(cor_x,cor_y), fill=fill)
+                entity_text = canvas.create_text(cor_x,cor_y,text=str(node_id))
+                self.node_entities[node_id] = (entity,entity_text)
+            else:
+                entity,entity_text = self.node_entities[node_id]
+                if drawn[0] != cor_x or drawn[1] != cor_y:
+                    canvas.coords(entity,*self.get_node_coords(cor_x,cor_y))
+                    canvas.coords(entity_text,cor_x,cor_y)
+                    moved.add(node_id)
+                if drawn[2] != highlighted:
+                    canvas.itemconfigure(entity,fill=fill)
+            drawn_nodes[node_id] = node[1:]
+
+        drawn_edges = self.drawn_edges
+        edge_entities = self.edge_entities
+        for n1_id,n2_id,highlighted in frame.edges:
+            key = (n1_id,n2_id)
+            drawn = drawn_edges.get(key)
+            if drawn is None:
+                coords = self.get_edge_coords(*drawn_nodes[n1_id][:2],*drawn_nodes[n2_id][:2])
+                fill = self.highlight_colour if highlighted else self.edge_fill_colour
+                if self.free_lines:
+                    entity = self.free_lines.pop()
+                    canvas.coords(entity,*coords)
+                    canvas.itemconfigure(entity,fill=fill,state=tk.NORMAL)
+                else:
+                    entity = canvas.create_line(*coords, width=2, fill=fill)
+                edge_entities[key] = entity
+            else:
+                if n1_id in moved or n2_id in moved:
+                    canvas.coords(edge_entities[key],*self.get_edge_coords(*drawn_nodes[n1_id][:2],*drawn_nodes[n2_id][:2]))
+                if drawn != highlighted:
+                    canvas.itemconfigure(edge_entities[key],fill=self.highlight_colour if highlighted else self.edge_fill_colour)
+            drawn_edges[key] = highlighted
+
+        # frame.edges has no duplicates, more drawn edges than edges in the
+        # frame means some were removed
+        if len(drawn_edges) > len(frame.edges):
+            for key in drawn_edges.keys()-{(n1_id,n2_id) for n1_id,n2_id,_ in frame.edges}:
+                entity = edge_entities.pop(key)
+                del drawn_edges[key]
+                canvas.itemconfigure(entity,state=tk.HIDDEN)
+                self.free_lines.append(entity)
+
+        if frame.tick != self.tick:
+            canvas.itemconfigure(self.tick_text,text="timestep: {:>3}".format(frame.tick))
+            self.tick = frame.tick
@@ -0,0 +1,590 @@
+import asyncio
+from array import array
+from collections import deque, namedtuple
+from collections.abc import Mapping
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# a route of node_id's table changed: "install" (learned or replaced by
+# update, or set_route), "invalidate" (metric set to INVALID_METRIC by
+# set_lost_neighbours) or "seq_bump" (own seq number increased). The route
+# fields are the values after the change
+ROUTE_EVENT_KINDS = ("install","invalidate","seq_bump")
+RouteEvent = namedtuple("RouteEvent", ("kind","node_id","dst_id","next_hop","metric","seq_num","install_time"))
+
+class RouteEventStream(object):
+    # the events of one table from subscribe() until close(). Iterating
+    # yields (and consumes) the pending events and stops when there are none,
+    # "async for" waits for new ones until the stream is closed. The table's
+    # thread appends, the consumer may run on another thread: a waiting
+    # consumer's event is set through its loop
+    def __init__(self, routing_table):
+        self.routing_table = routing_table
+        self.pending = deque()
+        self.closed = False
+        # (loop, asyncio.Event) of the "async for", None before it waited
+        self.waker = None
+
+    def append(self, event):
+        self.pending.append(event)
+        self.wake()
+
+    def wake(self):
+        waker = self.waker
+        if waker is not None and not waker[1].is_set():
+            loop,wakeup = waker
+            loop.call_soon_threadsafe(wakeup.set)
+
+    def __iter__(self):
+        pending = self.pending
+        while pending:
+            yield pending.popleft()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.pending:
+            if self.closed:
+                raise StopAsyncIteration
+            if self.waker is None:
+                self.waker = (asyncio.get_running_loop(),asyncio.Event())
+            wakeup = self.waker[1]
+            wakeup.clear()
+            # an append before the clear has not set the event again
+            if self.pending or self.closed:
+                continue
+            await wakeup.wait()
+        return self.pending.popleft()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.routing_table.unsubscribe(self)
+            self.wake()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def format_route(dst_id, route):
+    next_hop,metric,dst_seq_num,install_time = route
+    return "|{:<6}|{:<7}|{:<6}|{:<5}|{:<5}|".format(dst_id,next_hop,metric,dst_seq_num,install_time%100000)
+
+
+class RoutingTable(object):
+    __slots__ = ("node","routes_dict","seq_number","dirty","changed_metrics","changed_routes","route_installs","subscribers")
+
+    def __init__(self, node):
+        self.node = node
+        self.routes_dict = dict()
+        self.seq_number = node.engine.node_randint(node,0,100)*2
+        self.routes_dict[self.node.node_id] = [self.node.node_id, 0, self.seq_number, 0]
+        # destinations changed since the last broadcast, shipped by incremental updates
+        self.dirty = set(self.routes_dict.keys())
+        self.changed_metrics = None
+        self.changed_routes = None
+        # routes written by update (learned or replaced), for the metrics
+        self.route_installs = 0
+        # RouteEventStreams, None while nobody listens
+        self.subscribers = None
+
+    def compare_routes(self,my_route,external_route):
+        next_hop1 = my_route[0]
+        metric1 = my_route[1]
+        seq_num1 = my_route[2]
+        next_hop2 = external_route[0]
+        metric2 = external_route[1]
+        seq_num2 = external_route[2]
+
+        if seq_num2 < seq_num1:
+            return "no_news"
+
+        if seq_num2 == seq_num1:
+            if metric2 < metric1:
+                return "update_table_broadcast"
+            else:
+                return "no_news"
+
+        if not metric2 == metric1 or not next_hop1 == next_hop2:
+            return "update_table_broadcast"
+        else:
+            return "update_table"
+
+
+    def update(self, neighbour_routing_table,updt_time):
+        broadcast = False
+        for k,other_route in neighbour_routing_table.items():
+            other_entry_inf = (other_route[0],other_route[1],other_route[2])
+            if k in self.routes_dict:
+                my_route = self.routes_dict[k]
+                my_entry_inf = (my_route[0],my_route[1],my_route[2])
+                route_comparison = self.compare_routes(my_entry_inf,other_entry_inf)
+                if "update_table" in route_comparison:
+                    self.routes_dict[k] = [other_route[0],other_route[1],other_route[2],updt_time]
+                    self.dirty.add(k)
+                    self.route_installs += 1
+                    if self.changed_metrics is not None and not my_route[1] == other_route[1]:
+                        self.changed_metrics.add(k)
+                    if self.changed_routes is not None and not (my_route[0] == other_route[0] and my_route[1] == other_route[1]):
+                        self.changed_routes.add(k)
+                    if self.subscribers is not None:
+                        self.emit_route_event("install",k)
+                if "broadcast" in route_comparison:
+                    broadcast = route_comparison
+            else:
+                self.routes_dict[k] = [other_route[0],other_route[1],other_route[2],updt_time]
+                self.dirty.add(k)
+                self.route_installs += 1
+                if self.changed_metrics is not None:
+                    self.changed_metrics.add(k)
+                if self.changed_routes is not None:
+                    self.changed_routes.add(k)
+                if self.subscribers is not None:
+                    self.emit_route_event("install",k)
+                broadcast = True
+
+        return broadcast
+
+
+    def track_metric_changes(self):
+        # from now on collect destinations whose metric changed (or that were
+        # learned) until the next pop_metric_changes
+        self.changed_metrics = set(self.routes_dict.keys())
+
+    def pop_metric_changes(self):
+        changed_metrics = self.changed_metrics
+        self.changed_metrics = set()
+        return changed_metrics
+
+    def track_route_changes(self):
+        # like track_metric_changes, but also for next_hop changes; refreshes
+        # that only carry a newer seq number are not collected
+        self.changed_routes = set(self.routes_dict.keys())
+
+    def pop_route_changes(self):
+        changed_routes = self.changed_routes
+        self.changed_routes = set()
+        return changed_routes
+
+    def set_route(self, k, next_hop, metric, seq_num, install_time):
+        self.routes_dict[k] = [next_hop, metric, seq_num, install_time]
+        self.dirty.add(k)
+        self.route_installs += 1
+        if self.subscribers is not None:
+            self.emit_route_event("install",k)
+
+    def subscribe(self):
+        stream = RouteEventStream(self)
+        if self.subscribers is None:
+            self.subscribers = []
+        self.subscribers.append(stream)
+        return stream
+
+    def unsubscribe(self, stream):
+        self.subscribers.remove(stream)
+        if not self.subscribers:
+            self.subscribers = None
+
+    def emit_route_event(self, kind, k):
+        next_hop,metric,seq_num,install_time = self.routes_dict[k]
+        event = RouteEvent(kind,self.node.node_id,k,next_hop,metric,seq_num,install_time)
+        for stream in self.subscribers:
+            stream.append(event)
+
+    def recv_string_decode(self, routes_dict):
+        # json turns the integer keys into strings, convert them once here
+        return {int(k): v for k,v in routes_dict.items()}
+
+    def get_send_dict(self, full=True):
+        send_dict = dict()
+        keys = self.routes_dict.keys() if full else sorted(self.dirty)
+        for k in keys:
+            next_hop,metric,dst_seq_num,install_time = self.routes_dict[k]
+            send_dict[k] = (self.node.node_id, metric+1, dst_seq_num)
+        self.dirty = set()
+        return send_dict
+
+    def get_string_header(self):
+        out  = "##### Routing Table for #{:<3} ######".format(self.node.node_id)
+        out += "\n"
+        out += "|DestID|NextHop|Metric|SeqNo|InstT|"
+        return out
+
+    def to_string(self):
+        out = self.get_string_header()
+        for k in sorted(self.routes_dict.keys()):
+            out += "\n"
+            out += format_route(k,self.routes_dict[k])
+        return out
+
+    def increase_seq_number(self):
+        self.seq_number += 2
+        self.routes_dict[self.node.node_id][2] = self.seq_number
+        self.dirty.add(self.node.node_id)
+        if self.subscribers is not None:
+            self.emit_route_event("seq_bump",self.node.node_id)
+
+    def set_lost_neighbours(self,lost_neighbours):
+        for lost_neighbour in lost_neighbours:
+            if self.routes_dict[lost_neighbour][1] < 100000:
+                self.routes_dict[lost_neighbour][2] += 1
+                self.routes_dict[lost_neighbour][1] = 100000
+                self.dirty.add(lost_neighbour)
+                if self.changed_metrics is not None:
+                    self.changed_metrics.add(lost_neighbour)
+                if self.changed_routes is not None:
+                    self.changed_routes.add(lost_neighbour)
+                if self.subscribers is not None:
+                    self.emit_route_event("invalidate",lost_neighbour)
+            for k in self.routes_dict.keys():
+                next_hop = self.routes_dict[k][0]
+                if next_hop == lost_neighbour:
+                    if self.routes_dict[k][1] < 100000:
+                        self.routes_dict[k][2] += 1
+                        self.routes_dict[k][1] = 100000
+                        self.dirty.add(k)
+                        if self.changed_metrics is not None:
+                            self.changed_metrics.add(k)
+                        if self.changed_routes is not None:
+                            self.changed_routes.add(k)
+                        if self.subscribers is not None:
+                            self.emit_route_event("invalidate",k)
+
+
+NO_ROUTE = -1
+INVALID_METRIC = 100000
+
+class ColumnRoutesView(Mapping):
+    # read-only {dst_id: [next_hop, metric, seq, install_time]} view of an
+    # ArrayRoutingTable, so code written against routes_dict keeps working
+    __slots__ = ("table",)
+
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, k):
+        if not self.table.has_route(k):
+            raise KeyError(k)
+        return self.table.get_route(k)
+
+    def __contains__(self, k):
+        return self.table.has_route(k)
+
+    def __iter__(self):
+        return iter(self.table.route_ids())
+
+    def __len__(self):
+        return self.table.num_routes
+
+
+class ArrayRoutingTable(RoutingTable):
+    # one contiguous column per field indexed by destination node id, memory
+    # is 4 * itemsize bytes per destination regardless of how routes change
+    __slots__ = ("next_hops","metrics","seq_numbers","install_times","num_routes")
+    typecode = "i"
+
+    def __init__(self, node):
+        self.node = node
+        self.next_hops = array(self.typecode)
+        self.metrics = array(self.typecode)
+        self.seq_numbers = array(self.typecode)
+        self.install_times = array(self.typecode)
+        self.num_routes = 0
+        self.routes_dict = ColumnRoutesView(self)
+
+        self.seq_number = node.engine.node_randint(node,0,100)*2
+        self.dirty = set()
+        self.changed_metrics = None
+        self.changed_routes = None
+        self.route_installs = 0
+        self.subscribers = None
+        self.set_route(self.node.node_id, self.node.node_id, 0, self.seq_number, 0)
+
+    def ensure_capacity(self, node_id):
+        missing = node_id+1-len(self.next_hops)
+        if missing > 0:
+            self.next_hops.extend(array(self.typecode,[NO_ROUTE])*missing)
+            self.metrics.extend(array(self.typecode,[0])*missing)
+            self.seq_numbers.extend(array(self.typecode,[0])*missing)
+            self.install_times.extend(array(self.typecode,[0])*missing)
+
+    def has_route(self, k):
+        return 0 <= k < len(self.next_hops) and not self.next_hops[k] == NO_ROUTE
+
+    def get_route(self, k):
+        return [self.next_hops[k],self.metrics[k],self.seq_numbers[k],self.install_times[k]]
+
+    def route_ids(self):
+        return [k for k,next_hop in enumerate(self.next_hops) if not next_hop == NO_ROUTE]
+
+    def set_route(self, k, next_hop, metric, seq_num, install_time):
+        self.ensure_capacity(k)
+        if self.next_hops[k] == NO_ROUTE:
+            self.num_routes += 1
+            if self.changed_metrics is not None:
+                self.changed_metrics.add(k)
+            if self.changed_routes is not None:
+                self.changed_routes.add(k)
+        else:
+            if self.changed_metrics is not None and not self.metrics[k] == metric:
+                self.changed_metrics.add(k)
+            if self.changed_routes is not None and not (self.metrics[k] == metric and self.next_hops[k] == next_hop):
+                self.changed_routes.add(k)
+        self.next_hops[k] = next_hop
+        self.metrics[k] = metric
+        self.seq_numbers[k] = seq_num
+        self.install_times[k] = install_time
+        self.dirty.add(k)
+        self.route_installs += 1
+        if self.subscribers is not None:
+            self.emit_route_event("install",k)
+
+    def update(self, neighbour_routing_table,updt_time):
+        # same decisions as RoutingTable.compare_routes, inlined on the columns
+        broadcast = False
+        capacity = len(self.next_hops)
+        for k,other_route in neighbour_routing_table.items():
+            next_hop2,metric2,seq_num2 = other_route[0],other_route[1],other_route[2]
+            if k >= capacity or self.next_hops[k] == NO_ROUTE:
+                self.set_route(k,next_hop2,metric2,seq_num2,updt_time)
+                capacity = len(self.next_hops)
+                broadcast = True
+                continue
+
+            seq_num1 = self.seq_numbers[k]
+            if seq_num2 < seq_num1:
+                continue
+            metric1 = self.metrics[k]
+            if seq_num2 == seq_num1:
+                if metric2 < metric1:
+                    self.set_route(k,next_hop2,metric2,seq_num2,updt_time)
+                    broadcast = True
+                continue
+
+            if not metric2 == metric1 or not self.next_hops[k] == next_hop2:
+                broadcast = True
+            self.set_route(k,next_hop2,metric2,seq_num2,updt_time)
+
+        return broadcast
+
+    def get_send_dict(self, full=True):
+        send_dict = dict()
+        node_id = self.node.node_id
+        metrics,seq_numbers = self.metrics,self.seq_numbers
+        keys = self.routes_dict if full else sorted(self.dirty)
+        for k in keys:
+            send_dict[k] = (node_id, metrics[k]+1, seq_numbers[k])
+        self.dirty = set()
+        return send_dict
+
+    def increase_seq_number(self):
+        self.seq_number += 2
+        self.seq_numbers[self.node.node_id] = self.seq_number
+        self.dirty.add(self.node.node_id)
+        if self.subscribers is not None:
+            self.emit_route_event("seq_bump",self.node.node_id)
+
+    def invalidate_route(self, k):
+        if self.metrics[k] < INVALID_METRIC:
+            self.seq_numbers[k] += 1
+            self.metrics[k] = INVALID_METRIC
+            self.dirty.add(k)
+            if self.changed_metrics is not None:
+                self.changed_metrics.add(k)
+            if self.changed_routes is not None:
+                self.changed_routes.add(k)
+            if self.subscribers is not None:
+                self.emit_route_event("invalidate",k)
+
+    def set_lost_neighbours(self,lost_neighbours):
+        for lost_neighbour in lost_neighbours:
+            self.invalidate_route(lost_neighbour)
+            for k,next_hop in enumerate(self.next_hops):
+                if next_hop == lost_neighbour:
+                    self.invalidate_route(k)
+
+
+class RouteBatch(Mapping):
+    # immutable column form of a send_dict {dst_id: (next_hop, metric, seq)},
+    # NumpyRoutingTable applies it in one go, other backends read it as a mapping
+    __slots__ = ("dst_ids","next_hops","metrics","seq_numbers")
+
+    def __init__(self, dst_ids, next_hops, metrics, seq_numbers):
+        for column in (dst_ids,next_hops,metrics,seq_numbers):
+            column.flags.writeable = False
+        self.dst_ids = dst_ids
+        self.next_hops = next_hops
+        self.metrics = metrics
+        self.seq_numbers = seq_numbers
+
+    @classmethod
+    def from_mapping(cls, routes):
+        num_routes = len(routes)
+        dst_ids = np.fromiter(routes.keys(), dtype=np.int64, count=num_routes)
+        values = np.array(list(routes.values()), dtype=np.int64).reshape(num_routes,3)
+        return cls(dst_ids,values[:,0].copy(),values[:,1].copy(),values[:,2].copy())
+
+    def __getitem__(self, k):
+        positions = np.flatnonzero(self.dst_ids == k)
+        if len(positions) == 0:
+            raise KeyError(k)
+        i = positions[0]
+        return (int(self.next_hops[i]),int(self.metrics[i]),int(self.seq_numbers[i]))
+
+    def __iter__(self):
+        return iter(self.dst_ids.tolist())
+
+    def __len__(self):
+        return len(self.dst_ids)
+
+    def items(self):
+        return zip(self.dst_ids.tolist(),zip(self.next_hops.tolist(),self.metrics.tolist(),self.seq_numbers.tolist()))
+
+
+class NumpyRoutingTable(ArrayRoutingTable):
+    # ArrayRoutingTable with NumPy columns, a received table is relaxed with
+    # a handful of masked array operations instead of a loop per destination
+    __slots__ = ()
+    dtype = np.int32 if np is not None else None
+
+    def __init__(self, node):
+        self.node = node
+        self.next_hops = np.full(0,NO_ROUTE,dtype=self.dtype)
+        self.metrics = np.zeros(0,dtype=self.dtype)
+        self.seq_numbers = np.zeros(0,dtype=self.dtype)
+        self.install_times = np.zeros(0,dtype=self.dtype)
+        self.dirty = np.zeros(0,dtype=bool)
+        self.changed_metrics = None
+        self.changed_routes = None
+        self.route_installs = 0
+        self.subscribers = None
+        self.num_routes = 0
+        self.routes_dict = ColumnRoutesView(self)
+
+        self.seq_number = node.engine.node_randint(node,0,100)*2
+        self.set_route(self.node.node_id, self.node.node_id, 0, self.seq_number, 0)
+
+    def ensure_capacity(self, node_id):
+        capacity = len(self.next_hops)
+        if node_id < capacity:
+            return
+        missing = max(node_id+1, 2*capacity)-capacity
+        self.next_hops = np.concatenate((self.next_hops,np.full(missing,NO_ROUTE,dtype=self.dtype)))
+        self.metrics = np.concatenate((self.metrics,np.zeros(missing,dtype=self.dtype)))
+        self.seq_numbers = np.concatenate((self.seq_numbers,np.zeros(missing,dtype=self.dtype)))
+        self.install_times = np.concatenate((self.install_times,np.zeros(missing,dtype=self.dtype)))
+        self.dirty = np.concatenate((self.dirty,np.zeros(missing,dtype=bool)))
+
+    def get_route(self, k):
+        return [int(self.next_hops[k]),int(self.metrics[k]),int(self.seq_numbers[k]),int(self.install_times[k])]
+
+    def route_ids(self):
+        return np.flatnonzero(self.next_hops != NO_ROUTE).tolist()
+
+    def set_route(self, k, next_hop, metric, seq_num, install_time):
+        self.ensure_capacity(k)
+        if self.next_hops[k] == NO_ROUTE:
+            self.num_routes += 1
+            if self.changed_metrics is not None:
+                self.changed_metrics.add(k)
+            if self.changed_routes is not None:
+                self.changed_routes.add(k)
+        else:
+            if self.changed_metrics is not None and not self.metrics[k] == metric:
+                self.changed_metrics.add(k)
+            if self.changed_routes is not None and not (self.metrics[k] == metric and self.next_hops[k] == next_hop):
+                self.changed_routes.add(k)
+        self.next_hops[k] = next_hop
+        self.metrics[k] = metric
+        self.seq_numbers[k] = seq_num
+        self.install_times[k] = install_time
+        self.dirty[k] = True
+        self.route_installs += 1
+        if self.subscribers is not None:
+            self.emit_route_event("install",k)
+
+    def update(self, neighbour_routing_table,updt_time):
+        if not isinstance(neighbour_routing_table, RouteBatch):
+            neighbour_routing_table = RouteBatch.from_mapping(neighbour_routing_table)
+        batch = neighbour_routing_table
+        if len(batch) == 0:
+            return False
+        self.ensure_capacity(int(batch.dst_ids.max()))
+
+        dst_ids = batch.dst_ids
+        next_hop1 = self.next_hops[dst_ids]
+        metric1 = self.metrics[dst_ids]
+        seq_num1 = self.seq_numbers[dst_ids]
+        next_hop2,metric2,seq_num2 = batch.next_hops,batch.metrics,batch.seq_numbers
+
+        unknown = next_hop1 == NO_ROUTE
+        known = ~unknown
+        shorter = known & (seq_num2 == seq_num1) & (metric2 < metric1)
+        newer = known & (seq_num2 > seq_num1)
+        changed = newer & ((metric2 != metric1) | (next_hop2 != next_hop1))
+
+        install = unknown | shorter | newer
+        install_ids = dst_ids[install]
+        if self.changed_metrics is not None:
+            self.changed_metrics.update(dst_ids[unknown | (install & (metric2 != metric1))].tolist())
+        if self.changed_routes is not None:
+            self.changed_routes.update(dst_ids[unknown | (install & ((metric2 != metric1) | (next_hop2 != next_hop1)))].tolist())
+        self.next_hops[install_ids] = next_hop2[install]
+        self.metrics[install_ids] = metric2[install]
+        self.seq_numbers[install_ids] = seq_num2[install]
+        self.install_times[install_ids] = updt_time
+        self.dirty[install_ids] = True
+        self.num_routes += int(np.count_nonzero(unknown))
+        self.route_installs += len(install_ids)
+        if self.subscribers is not None:
+            for k in install_ids.tolist():
+                self.emit_route_event("install",k)
+
+        return bool(np.any(unknown | shorter | changed))
+
+    def get_send_dict(self, full=True):
+        if full:
+            dst_ids = np.flatnonzero(self.next_hops != NO_ROUTE)
+        else:
+            dst_ids = np.flatnonzero(self.dirty)
+        self.dirty[:] = False
+        next_hops = np.full(len(dst_ids),self.node.node_id,dtype=self.dtype)
+        return RouteBatch(dst_ids,next_hops,self.metrics[dst_ids]+1,self.seq_numbers[dst_ids])
+
+    def increase_seq_number(self):
+        self.seq_number += 2
+        self.seq_numbers[self.node.node_id] = self.seq_number
+        self.dirty[self.node.node_id] = True
+        if self.subscribers is not None:
+            self.emit_route_event("seq_bump",self.node.node_id)
+
+    def set_lost_neighbours(self,lost_neighbours):
+        if not lost_neighbours:
+            return
+        lost = np.asarray(lost_neighbours)
+        invalidate = np.zeros(len(self.next_hops),dtype=bool)
+        invalidate[lost] = True
+        invalidate |= np.isin(self.next_hops,lost)
+        invalidate &= self.metrics < INVALID_METRIC
+        self.seq_numbers[invalidate] += 1
+        self.metrics[invalidate] = INVALID_METRIC
+        self.dirty |= invalidate
+        if self.changed_metrics is not None:
+            self.changed_metrics.update(np.flatnonzero(invalidate).tolist())
+        if self.changed_routes is not None:
+            self.changed_routes.update(np.flatnonzero(invalidate).tolist())
+        if self.subscribers is not None:
+            for k in np.flatnonzero(invalidate).tolist():
+                self.emit_route_event("invalidate",k)
+
+
+ROUTING_TABLE_BACKENDS = {"dict": RoutingTable, "array": ArrayRoutingTable}
+if np is not None:
+    ROUTING_TABLE_BACKENDS["numpy"] = NumpyRoutingTable
@@ -0,0 +1,362 @@
+import argparse
+import multiprocessing
+import os
+import random
+import struct
+import time
+import traceback
+from array import array
+from multiprocessing import shared_memory
+
+from dsdv_engine import Engine, Node, add_engine_arguments, get_engine_kwargs
+from dsdv_spatial import find_pairs_within
+from dsdv_routing import RouteBatch
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# One network simulated by several processes. The plane is cut into strips
+# with the same number of nodes, every shard process runs an Engine with the
+# nodes of its strip. Broadcasts of nodes within tx range of another strip
+# (boundary senders) are written to the shard's outbox, a shared memory
+# segment, after phase 0 of every tick; in phase 1 the neighbouring shards
+# replay them from "ghost" copies of those senders, merged with their own
+# transmissions in node id order as the single engine delivers them. A
+# barrier after each phase keeps the shards in lockstep.
+#
+# The nodes draw from per node random streams (rng_streams="per_node"), so a
+# sharded run gives exactly the results of Engine(..., seed=seed,
+# rng_streams="per_node") for any number of shards. Static networks on the
+# tick scheduler and unit disk medium only: no mobility, no event engine, no
+# loss or collisions.
+#
+# outbox, int64 items:
+#   number of messages n, n src ids, n entry counts,
+#   per message: dst ids, next hops, metrics, seq numbers
+# directory, one OUTBOX_SLOT per shard: name and size of its current outbox,
+# which is replaced by a larger one when a tick's messages do not fit
+
+OUTBOX_SLOT = struct.Struct("<32sQ")
+MIN_OUTBOX_SIZE = 1 << 16
+
+def partition(positions, num_shards, axis):
+    # shard of every node: strips along axis (0: x, 1: y), equal node counts
+    order = sorted(range(len(positions)), key=lambda i: positions[i][axis])
+    shard_ids = [0]*len(positions)
+    for rank,i in enumerate(order):
+        shard_ids[i] = rank*num_shards//len(positions)
+    return shard_ids
+
+
+def find_boundaries(positions, shard_ids, num_shards, tx_range):
+    # exports[s]: nodes of s heard in other shards, ghosts[s]: nodes of other
+    # shards heard in s, sources[s]: the shards s receives from. Slightly
+    # larger than tx_range, a ghost too many only costs its delivery check
+    exports = [set() for _ in range(num_shards)]
+    ghosts = [set() for _ in range(num_shards)]
+    sources = [set() for _ in range(num_shards)]
+    xs = [cor_x for cor_x,cor_y in positions]
+    ys = [cor_y for cor_x,cor_y in positions]
+    for i,j in find_pairs_within(xs,ys,tx_range*(1+1e-9)):
+        shard_i,shard_j = shard_ids[i],shard_ids[j]
+        if shard_i == shard_j:
+            continue
+        exports[shard_i].add(i)
+        exports[shard_j].add(j)
+        ghosts[shard_j].add(i)
+        ghosts[shard_i].add(j)
+        sources[shard_j].add(shard_i)
+        sources[shard_i].add(shard_j)
+    return exports,ghosts,sources
+
+
+def get_node_state(node):
+    # what a sharded run has to reproduce of every node
+    routes = {dst_id: list(route) for dst_id,route in node.routing_table.routes_dict.items()}
+    return (node.node_id,routes,dict(node.neighbours),node.periodic_update_counter,
+            node.update_triggered,node.routing_table.seq_number,node.rng_draws)
+
+
+def get_route_columns(routes):
+    if isinstance(routes, RouteBatch):
+        return b"".join(column.astype(np.int64).tobytes() for column in (routes.dst_ids,routes.next_hops,routes.metrics,routes.seq_numbers))
+    values = list(routes.values())
+    columns = [array("q",routes.keys())]+[array("q",[value[i] for value in values]) for i in range(3)]
+    return b"".join(column.tobytes() for column in columns)
+
+
+class Shard(object):
+    def __init__(self, shard_id, width, height, seed, engine_kwargs, positions, node_ids, ghost_ids, export_ids, source_shards, directory_name, barrier):
+        self.shard_id = shard_id
+        self.engine = Engine(width,height,seed=seed,rng_streams="per_node",**engine_kwargs)
+        for node_id in sorted(node_ids):
+            self.engine.add_node(*positions[node_id],node_id)
+        # senders of the other shards, never stepped and not in the spatial
+        # grid, they only replay received broadcasts
+        self.ghosts = {node_id: Node(self.engine,*positions[node_id],self.engine.node_tx_range,node_id) for node_id in ghost_ids}
+        self.export_ids = set(export_ids)
+        self.source_shards = sorted(source_shards)
+        self.barrier = barrier
+        self.directory = shared_memory.SharedMemory(name=directory_name)
+        self.outbox = None
+        self.inboxes = dict()
+
+    def write_outbox(self):
+        src_ids = []
+        counts = []
+        columns = []
+        for send_node,message,tx_range in self.engine.medium_transmission_buffer:
+            if send_node.node_id in self.export_ids:
+                src_id,routes = send_node.decode_packet(message)
+                src_ids.append(src_id)
+                counts.append(len(routes))
+                columns.append(get_route_columns(routes))
+        data = array("q",[len(src_ids)]+src_ids+counts).tobytes()+b"".join(columns)
+        if self.outbox is None or len(data) > self.outbox.size:
+            self.replace_outbox(len(data))
+        self.outbox.buf[:len(data)] = data
+
+    def replace_outbox(self, size):
+        # the readers switch over when they see the new name in the
+        # directory, the old segment stays mapped for them until then
+        old_outbox = self.outbox
+        capacity = max(size,MIN_OUTBOX_SIZE,2*old_outbox.size if old_outbox is not None else 0)
+        self.outbox = shared_memory.SharedMemory(create=True, size=capacity)
+        OUTBOX_SLOT.pack_into(self.directory.buf,self.shard_id*OUTBOX_SLOT.size,self.outbox.name.encode("ascii"),capacity)
+        if old_outbox is not None:
+            old_outbox.close()
+            old_outbox.unlink()
+
+    def get_inbox(self, shard_id):
+        name,capacity = OUTBOX_SLOT.unpack_from(self.directory.buf,shard_id*OUTBOX_SLOT.size)
+        name = name.rstrip(b"\0").decode("ascii")
+        inbox = self.inboxes.get(shard_id)
+        if inbox is None or not inbox.name == name:
+            if inbox is not None:
+                inbox.close()
+            inbox = self.inboxes[shard_id] = shared_memory.SharedMemory(name=name)
+        return inbox
+
+    def read_inbox(self, shard_id):
+        engine = self.engine
+        transmissions = []
+        inbox = self.get_inbox(shard_id)
+        with inbox.buf.cast("q") as data:
+            num_messages = data[0]
+            src_ids = data[1:1+num_messages].tolist()
+            counts = data[1+num_messages:1+2*num_messages].tolist()
+            offset = 1+2*num_messages
+            for src_id,count in zip(src_ids,counts):
+                ghost = self.ghosts.get(src_id)
+                if ghost is not None:
+                    columns = [data[offset+i*count:offset+(i+1)*count] for i in range(4)]
+                    if engine.routing_table_backend == "numpy":
+                        routes = RouteBatch(*(np.array(column,dtype=np.int64) for column in columns))
+                    else:
+                        dst_ids,next_hops,metrics,seq_numbers = (column.tolist() for column in columns)
+                        routes = dict(zip(dst_ids,zip(next_hops,metrics,seq_numbers)))
+                    for column in columns:
+                        column.release()
+                    transmissions.append((ghost,ghost.encode_packet(routes),ghost.tx_range))
+                offset += 4*count
+        return transmissions
+
+    def step(self):
+        engine = self.engine
+        engine.update_step()
+        self.write_outbox()
+        self.barrier.wait()
+        transmissions = engine.medium_transmission_buffer
+        for shard_id in self.source_shards:
+            transmissions.extend(self.read_inbox(shard_id))
+        # every node sends at most once per tick, the single engine delivers in node order
+        transmissions.sort(key=lambda transmission: transmission[0].node_id)
+        engine.update_step()
+        # nobody reads an outbox any more when it is rewritten
+        self.barrier.wait()
+
+    def run(self, ticks):
+        for _ in range(ticks):
+            self.step()
+
+    def gather(self):
+        return [get_node_state(node) for node in self.engine.nodes]
+
+    def close(self):
+        for inbox in self.inboxes.values():
+            inbox.close()
+        if self.outbox is not None:
+            self.outbox.close()
+            self.outbox.unlink()
+        self.directory.close()
+
+
+def shard_main(connection, barrier, *args):
+    shard = None
+    try:
+        shard = Shard(*args, barrier=barrier)
+        connection.send(("ok",None))
+        while True:
+            command,argument = connection.recv()
+            if command == "close":
+                break
+            if command == "run":
+                shard.run(argument)
+                connection.send(("ok",(shard.engine.tick,shard.engine.stats)))
+            elif command == "gather":
+                connection.send(("ok",shard.gather()))
+    except Exception:
+        # the other shards would wait for this one forever
+        barrier.abort()
+        connection.send(("error",traceback.format_exc()))
+        return
+    finally:
+        if shard is not None:
+            shard.close()
+    connection.send(("ok",None))
+
+
+class ShardedSimulation(object):
+    def __init__(self, width, height, num_shards=None, seed=None, scheduler="tick", mobility=None, rng_streams="per_node", medium=None, **engine_kwargs):
+        if not scheduler == "tick":
+            raise ValueError("sharded runs need the tick scheduler, got {!r}".format(scheduler))
+        if mobility is not None:
+            raise ValueError("sharded runs need a static network, got mobility {!r}".format(mobility))
+        if medium not in (None,"unit_disk"):
+            raise ValueError("sharded runs need the unit disk medium, got {!r}".format(medium))
+        if not rng_streams == "per_node":
+            raise ValueError("sharded runs draw from per node streams, got rng_streams {!r}".format(rng_streams))
+        self.width = width
+        self.height = height
+        self.num_shards = num_shards or os.cpu_count()
+        # unseeded runs get a seed too, so that they can be repeated
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.engine_kwargs = engine_kwargs
+        # settings and node positions, it simulates nothing itself
+        self.engine = Engine(width,height,seed=self.seed,rng_streams="per_node",**engine_kwargs)
+        self.processes = []
+        self.connections = []
+        self.directory = None
+        self.tick = 0
+        self.stats = dict(self.engine.stats)
+
+    def initialise_network(self, number_nodes):
+        self.close()
+        engine = self.engine
+        positions = engine.generate_node_positions(number_nodes)
+        num_shards = max(1,min(self.num_shards,len(positions)))
+        shard_ids = partition(positions,num_shards,0 if self.width >= self.height else 1)
+        exports,ghosts,sources = find_boundaries(positions,shard_ids,num_shards,engine.node_tx_range)
+        nodes_per_shard = [[] for _ in range(num_shards)]
+        for node_id,shard_id in enumerate(shard_ids):
+            nodes_per_shard[shard_id].append(node_id)
+        self.number_nodes = len(positions)
+        self.shard_sizes = [len(node_ids) for node_ids in nodes_per_shard]
+        self.boundary_nodes = sum(len(export_ids) for export_ids in exports)
+
+        self.directory = shared_memory.SharedMemory(create=True, size=num_shards*OUTBOX_SLOT.size)
+        barrier = multiprocessing.Barrier(num_shards)
+        for shard_id in range(num_shards):
+            connection,child_connection = multiprocessing.Pipe()
+            args = (shard_id,self.width,self.height,self.seed,self.engine_kwargs,positions,nodes_per_shard[shard_id],
+                    ghosts[shard_id],exports[shard_id],sources[shard_id],self.directory.name)
+            process = multiprocessing.Process(target=shard_main, args=(child_connection,barrier)+args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            self.connections.append(connection)
+        self.receive_all()
+        self.tick = 0
+
+    def receive_all(self):
+        results = []
+        errors = []
+        for connection in self.connections:
+            status,result = connection.recv()
+            if status == "error":
+                errors.append(result)
+            results.append(result)
+        if errors:
+            # failed shards have exited, the others are stopped, and the
+            # original error is reported rather than the broken barriers
+            for connection,result in zip(self.connections,results):
+                if result not in errors:
+                    connection.send(("close",None))
+                    connection.recv()
+            for process in self.processes:
+                process.join()
+            self.processes = []
+            self.connections = []
+            self.close()
+            errors.sort(key=lambda error: "BrokenBarrierError" in error.splitlines()[-1])
+            raise RuntimeError("shard failed:\n"+errors[0])
+        return results
+
+    def send_all(self, command, argument=None):
+        for connection in self.connections:
+            connection.send((command,argument))
+        return self.receive_all()
+
+    def run(self, ticks):
+        results = self.send_all("run",ticks)
+        self.tick = results[0][0]
+        self.stats = {key: sum(stats[key] for tick,stats in results) for key in results[0][1]}
+
+    def gather(self):
+        # get_node_state of every node, in node id order
+        return sorted((state for states in self.send_all("gather") for state in states), key=lambda state: state[0])
+
+    def close(self):
+        if self.processes:
+            try:
+                self.send_all("close")
+            finally:
+                for process in self.processes:
+                    process.join()
+                self.processes = []
+                self.connections = []
+        if self.directory is not None:
+            self.directory.close()
+            self.directory.unlink()
+            self.directory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="headless DSDV simulation of one network on several processes")
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--shards", type=int, default=None, help="worker processes, default: one per core")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verify", action="store_true", help="compare with a single process run of the same seed")
+    add_engine_arguments(parser)
+    parser.set_defaults(rng_streams="per_node")
+    args = parser.parse_args()
+
+    engine_kwargs = get_engine_kwargs(args)
+    with ShardedSimulation(args.width,args.height,args.shards,args.seed,**engine_kwargs) as simulation:
+        simulation.initialise_network(args.nodes)
+        start_time = time.time()
+        simulation.run(args.ticks)
+        duration = time.time()-start_time
+        print("{} nodes on {} shards (sizes {}, {} boundary nodes), seed {}".format(simulation.number_nodes,len(simulation.processes),
+                                                                                   simulation.shard_sizes,simulation.boundary_nodes,simulation.seed))
+        print("{} ticks in {:.3f}s ({:.1f} ticks/s)".format(simulation.tick,duration,simulation.tick/max(duration,1e-9)))
+        print(simulation.stats)
+        if args.verify:
+            node_states = simulation.gather()
+
+    if args.verify:
+        engine_kwargs.pop("scheduler")
+        engine = Engine(args.width,args.height,seed=simulation.seed,**engine_kwargs)
+        engine.initialise_network(args.nodes)
+        engine.run(args.ticks)
+        same = node_states == [get_node_state(node) for node in engine.nodes] and simulation.stats == engine.stats
+        print("single process run: {}".format("identical" if same else "DIFFERENT"))
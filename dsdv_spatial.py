@@ -0,0 +1,127 @@
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class Point(object):
+    # bare position for grids over things that are not nodes
+    __slots__ = ("cor_x","cor_y","index")
+
+    def __init__(self, cor_x, cor_y, index=None):
+        self.cor_x = cor_x
+        self.cor_y = cor_y
+        self.index = index
+
+
+class SpatialGrid(object):
+    # uniform grid over the plane, cell_size is normally the tx_range so a
+    # range query only has to look at the 3x3 cells around the sender
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = dict()
+        self.node_cells = dict()
+
+    def get_cell(self, cor_x, cor_y):
+        return (int(math.floor(cor_x/self.cell_size)), int(math.floor(cor_y/self.cell_size)))
+
+    def insert(self, node):
+        cell = self.get_cell(node.cor_x,node.cor_y)
+        if cell not in self.cells:
+            self.cells[cell] = dict()
+        self.cells[cell][node] = None
+        self.node_cells[node] = cell
+
+    def remove(self, node):
+        cell = self.node_cells.pop(node)
+        bucket = self.cells[cell]
+        del bucket[node]
+        if len(bucket) == 0:
+            del self.cells[cell]
+
+    def move(self, node):
+        cell = self.get_cell(node.cor_x,node.cor_y)
+        if not cell == self.node_cells[node]:
+            self.remove(node)
+            self.insert(node)
+
+    def clear(self):
+        self.cells = dict()
+        self.node_cells = dict()
+
+    def __len__(self):
+        return len(self.node_cells)
+
+    def candidates(self, cor_x, cor_y, radius):
+        reach = int(math.ceil(radius/self.cell_size))
+        cell_x,cell_y = self.get_cell(cor_x,cor_y)
+        for grid_x in range(cell_x-reach,cell_x+reach+1):
+            for grid_y in range(cell_y-reach,cell_y+reach+1):
+                bucket = self.cells.get((grid_x,grid_y))
+                if bucket:
+                    yield from bucket
+
+    def query(self, cor_x, cor_y, radius):
+        hypot = math.hypot
+        return [node for node in self.candidates(cor_x,cor_y,radius) if hypot(node.cor_x-cor_x,node.cor_y-cor_y) <= radius]
+
+
+def find_pairs_within(xs, ys, radius):
+    # all index pairs (i, j), i < j, with distance <= radius in lexicographic
+    # order, using a grid of radius sized cells instead of comparing all pairs
+    if np is None or len(xs) == 0:
+        return find_pairs_within_python(xs, ys, radius)
+
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    cell_x = np.floor(xs/radius).astype(np.int64)
+    cell_y = np.floor(ys/radius).astype(np.int64)
+    cell_x -= cell_x.min()-1
+    cell_y -= cell_y.min()-1
+    stride = int(cell_y.max())+2
+    keys = cell_x*stride+cell_y
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    pairs_i = []
+    pairs_j = []
+    # every cell pair is visited once, in both orientations for (0, 0)
+    for offset_x,offset_y in ((0,0),(1,-1),(1,0),(1,1),(0,1)):
+        target = keys+offset_x*stride+offset_y
+        start = np.searchsorted(sorted_keys, target, side="left")
+        end = np.searchsorted(sorted_keys, target, side="right")
+        counts = end-start
+        total = int(counts.sum())
+        if total == 0:
+            continue
+        i = np.repeat(np.arange(len(xs)), counts)
+        group_start = np.repeat(np.cumsum(counts)-counts, counts)
+        j = order[np.repeat(start, counts)+np.arange(total)-group_start]
+        within = np.hypot(xs[i]-xs[j], ys[i]-ys[j]) <= radius
+        if offset_x == 0 and offset_y == 0:
+            within &= i < j
+        pairs_i.append(i[within])
+        pairs_j.append(j[within])
+
+    if not pairs_i:
+        return []
+    i = np.concatenate(pairs_i)
+    j = np.concatenate(pairs_j)
+    low,high = np.minimum(i,j),np.maximum(i,j)
+    lexicographic = np.lexsort((high,low))
+    return list(zip(low[lexicographic].tolist(),high[lexicographic].tolist()))
+
+
+def find_pairs_within_python(xs, ys, radius):
+    grid = SpatialGrid(radius)
+    points = [Point(cor_x,cor_y,index) for index,(cor_x,cor_y) in enumerate(zip(xs,ys))]
+    for point in points:
+        grid.insert(point)
+    pairs = []
+    for point in points:
+        for other in grid.query(point.cor_x,point.cor_y,radius):
+            if other.index > point.index:
+                pairs.append((point.index,other.index))
+    pairs.sort()
+    return pairs
@@ -0,0 +1,146 @@
+import math
+import random
+import warnings
+
+from dsdv_spatial import SpatialGrid, Point
+
+# every generator returns a list of (cor_x, cor_y) inside
+# [margin, width-margin] x [margin, height-margin]; generators that keep a
+# minimum distance return fewer positions when the area is full,
+# generate_positions warns about that
+
+def is_inside(cor_x, cor_y, width, height, margin):
+    return margin <= cor_x <= width-margin and margin <= cor_y <= height-margin
+
+def has_free_space(grid, cor_x, cor_y, min_distance):
+    for point in grid.candidates(cor_x,cor_y,min_distance):
+        if math.hypot(point.cor_x-cor_x,point.cor_y-cor_y) <= min_distance:
+            return False
+    return True
+
+def sample_around(rng, point, min_distance, max_distance):
+    # uniform over the annulus min_distance < r < max_distance
+    radius = math.sqrt(rng.uniform(min_distance**2,max_distance**2))
+    angle = rng.uniform(0,2*math.pi)
+    return point.cor_x+radius*math.cos(angle),point.cor_y+radius*math.sin(angle)
+
+
+def poisson_disk(number_nodes, width, height, min_distance=60, max_distance=100, margin=15, candidates_per_point=30, rng=random):
+    # Bridson's algorithm grown from the centre: each new point lies in the
+    # (min_distance, max_distance) annulus of an accepted point, so it keeps
+    # node_min_distance to all nodes and has a node within
+    # node_at_most_one_max_distance, like the old rejection sampling
+    grid = SpatialGrid(min_distance)
+    first = Point(width/2,height/2)
+    grid.insert(first)
+    points = [first]
+    active = [first]
+    while active and len(points) < number_nodes:
+        active_i = rng.randrange(len(active))
+        parent = active[active_i]
+        for _ in range(candidates_per_point):
+            cor_x,cor_y = sample_around(rng,parent,min_distance,max_distance)
+            if is_inside(cor_x,cor_y,width,height,margin) and has_free_space(grid,cor_x,cor_y,min_distance):
+                point = Point(cor_x,cor_y)
+                grid.insert(point)
+                points.append(point)
+                active.append(point)
+                break
+        else:
+            active[active_i] = active[-1]
+            active.pop()
+    return [(point.cor_x,point.cor_y) for point in points[:number_nodes]]
+
+
+def random_geometric(number_nodes, width, height, margin=15, rng=random, **kwargs):
+    # uniform positions, the connectivity is whatever tx_range makes of it
+    return [(rng.uniform(margin,width-margin),rng.uniform(margin,height-margin)) for _ in range(number_nodes)]
+
+
+def get_lattice_shape(number_nodes, width, height, spacing):
+    # columns and rows of a near square lattice of number_nodes inside
+    # width x height, capped to what fits
+    columns = max(1,int(math.ceil(math.sqrt(number_nodes))))
+    columns = min(columns,int(width//spacing)+1)
+    rows = min(int(math.ceil(number_nodes/columns)),int(height//spacing)+1)
+    return columns,rows
+
+def grid_lattice(number_nodes, width, height, min_distance=60, max_distance=100, margin=15, **kwargs):
+    # square lattice with max_distance spacing, centred in the area. When
+    # that does not fit number_nodes the spacing shrinks to the widest
+    # lattice that does, down to min_distance
+    inner_width = width-2*margin
+    inner_height = height-2*margin
+    spacing = max_distance
+    columns,rows = get_lattice_shape(number_nodes,inner_width,inner_height,spacing)
+    if columns*rows < number_nodes:
+        widest = None
+        for shape_columns in range(1,number_nodes+1):
+            shape_rows = int(math.ceil(number_nodes/shape_columns))
+            shape_spacing = min(inner_width/(shape_columns-1) if shape_columns > 1 else math.inf,
+                                inner_height/(shape_rows-1) if shape_rows > 1 else math.inf)
+            if widest is None or shape_spacing > widest[0]:
+                widest = (shape_spacing,shape_columns,shape_rows)
+        if widest[0] >= min_distance:
+            spacing,columns,rows = widest
+        else:
+            spacing = min_distance
+            columns,rows = get_lattice_shape(number_nodes,inner_width,inner_height,spacing)
+    offset_x = (width-(columns-1)*spacing)/2
+    offset_y = (height-(rows-1)*spacing)/2
+    positions = []
+    for row in range(rows):
+        for column in range(columns):
+            positions.append((offset_x+column*spacing,offset_y+row*spacing))
+    return positions[:number_nodes]
+
+
+def scale_free(number_nodes, width, height, min_distance=60, max_distance=100, margin=15, candidates_per_point=30, rng=random):
+    # spatial preferential attachment: a new node is placed next to an
+    # existing node picked proportionally to its degree+1. Growth concentrates
+    # around well connected nodes, although min_distance still bounds degrees
+    grid = SpatialGrid(max_distance)
+    first = Point(width/2,height/2)
+    grid.insert(first)
+    points = [first]
+    attachment = [first]
+    saturated = set()
+    saturated_hits = 0
+    while len(points) < number_nodes and len(saturated) < len(points):
+        parent = rng.choice(attachment)
+        if parent in saturated:
+            saturated_hits += 1
+            if saturated_hits > len(attachment)//4:
+                attachment = [point for point in attachment if point not in saturated]
+                saturated_hits = 0
+            continue
+        for _ in range(candidates_per_point):
+            cor_x,cor_y = sample_around(rng,parent,min_distance,max_distance)
+            if is_inside(cor_x,cor_y,width,height,margin) and has_free_space(grid,cor_x,cor_y,min_distance):
+                break
+        else:
+            saturated.add(parent)
+            continue
+        point = Point(cor_x,cor_y)
+        points.append(point)
+        attachment.append(point)
+        for neighbour in grid.query(cor_x,cor_y,max_distance):
+            attachment.append(neighbour)
+            attachment.append(point)
+        grid.insert(point)
+    return [(point.cor_x,point.cor_y) for point in points[:number_nodes]]
+
+
+TOPOLOGIES = {"poisson_disk": poisson_disk,
+              "random_geometric": random_geometric,
+              "grid": grid_lattice,
+              "scale_free": scale_free}
+
+def generate_positions(topology, number_nodes, width, height, min_distance=60, max_distance=100, margin=15, rng=random):
+    if topology not in TOPOLOGIES:
+        raise ValueError("unknown topology {!r}, expected one of {}".format(topology,tuple(TOPOLOGIES)))
+    positions = TOPOLOGIES[topology](number_nodes, width, height, min_distance=min_distance, max_distance=max_distance, margin=margin, rng=rng)
+    if len(positions) < number_nodes:
+        warnings.warn("{} placed only {} of {} nodes in {}x{} (min_distance {}, max_distance {}), the area is full".format(
+            topology,len(positions),number_nodes,width,height,min_distance,max_distance),stacklevel=2)
+    return positions
@@ -0,0 +1,462 @@
+import argparse
+import bisect
+import mmap
+import struct
+from array import array
+
+from dsdv_engine import EngineObserver
+
+# Binary trace of a run, one chunk per half step that had any event,
+# appended and flushed as soon as the half step is finished:
+#
+#   file header   TRACE_HEADER (magic, version, width, height)
+#   chunk         CHUNK_HEADER (magic, tick, flags, payload size, 7 counts)
+#                 payload, columns in this order, every column 8 byte aligned:
+#                   positions      xs, ys (float64), node ids (int32)
+#                   edges added    n1 ids, n2 ids (int32)
+#                   edges removed  n1 ids, n2 ids (int32)
+#                   sends          node ids (int32)
+#                   receives       sender ids, receiver ids (int32)
+#                   route changes  node ids, dst ids, next hops, metrics, seqs (int32)
+#                   expiries       node ids, neighbour ids, heard ticks (int32)
+#   ...
+#   index         INDEX_HEADER + ticks (int64) + chunk offsets (int64)
+#   trailer       TRACE_TRAILER (magic, index offset)
+#
+# The index is written by close(); a trace of a crashed run has none and is
+# indexed by walking the chunk headers instead. A tick has up to two chunks:
+# the first half step (with what happened since the last tick, e.g. nodes
+# dragged in the GUI) and the second (CHUNK_SECOND_HALF, with the mobility
+# step at its end). Edges are the net changes of the chunk, an edge added and
+# removed again within it is not recorded. Route changes are the final entries
+# of routes whose next_hop or metric changed, refreshes that only carry a
+# newer seq number are not recorded. Expiries are the neighbour timestamps
+# that link-down notifications set back. Ticks are monotonic, after a network
+# reset (CHUNK_RESET) they continue counting.
+
+TRACE_MAGIC = b"DSDVTRCE"
+TRACE_VERSION = 2
+TRACE_HEADER = struct.Struct("<8sIIdd")
+CHUNK_MAGIC = b"TICK"
+CHUNK_HEADER = struct.Struct("<4sqII7I")
+INDEX_MAGIC = b"INDX"
+INDEX_HEADER = struct.Struct("<4sIq")
+TRACE_TRAILER = struct.Struct("<8sq")
+TRAILER_MAGIC = b"DSDVIDX\x00"
+
+CHUNK_RESET = 1
+CHUNK_SECOND_HALF = 2
+
+# (number of float64 columns, number of int32 columns) per record kind
+RECORD_COLUMNS = (("positions",2,1),
+                  ("edges_added",0,2),
+                  ("edges_removed",0,2),
+                  ("sends",0,1),
+                  ("receives",0,2),
+                  ("route_changes",0,5),
+                  ("expiries",0,3))
+
+def get_edge_key(n1_id, n2_id):
+    return (n1_id,n2_id) if n1_id < n2_id else (n2_id,n1_id)
+
+def padded(size):
+    return (size+7)//8*8
+
+
+class TraceRecorder(EngineObserver):
+    # streams the run of engine into path, attach before or after
+    # initialise_network; nodes that already exist are recorded at the start
+    def __init__(self, engine, path):
+        self.engine = engine
+        self.file = open(path, "wb")
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC,TRACE_VERSION,0,engine.width,engine.height))
+        self.ticks = []
+        self.offsets = []
+        self.tick_offset = 0
+        self.last_tick = -1
+        self.clear_records()
+
+        for node in engine.nodes:
+            self.node_added(node)
+        for edge in engine.edges:
+            self.edge_added(edge)
+        engine.add_observer(self)
+
+    def clear_records(self):
+        self.flags = 0
+        # edge key -> (n1 id, n2 id) of the chunk's net edge changes
+        self.edges_added = dict()
+        self.edges_removed = dict()
+        self.records = {"positions": ([array("d"),array("d")],[array("i")]),
+                        "edges_added": ([],[array("i"),array("i")]),
+                        "edges_removed": ([],[array("i"),array("i")]),
+                        "sends": ([],[array("i")]),
+                        "receives": ([],[array("i"),array("i")]),
+                        "route_changes": ([],[array("i") for _ in range(5)]),
+                        "expiries": ([],[array("i") for _ in range(3)])}
+
+    def add_position(self, node):
+        (xs,ys),(node_ids,) = self.records["positions"]
+        xs.append(node.cor_x)
+        ys.append(node.cor_y)
+        node_ids.append(node.node_id)
+
+# ---- EngineObserver callbacks ----
+
+    def network_reset(self, engine):
+        # what happened since the last chunk is wiped by the reset
+        self.clear_records()
+        self.tick_offset = self.last_tick+1
+        self.flags |= CHUNK_RESET
+
+    def node_added(self, node):
+        node.routing_table.track_route_changes()
+        self.add_position(node)
+
+    def node_moved(self, node):
+        self.add_position(node)
+
+    def edge_added(self, edge):
+        key = get_edge_key(edge.n1.node_id,edge.n2.node_id)
+        if self.edges_removed.pop(key,None) is None:
+            self.edges_added[key] = (edge.n1.node_id,edge.n2.node_id)
+
+    def edge_removed(self, edge):
+        key = get_edge_key(edge.n1.node_id,edge.n2.node_id)
+        if self.edges_added.pop(key,None) is None:
+            self.edges_removed[key] = (edge.n1.node_id,edge.n2.node_id)
+
+    def neighbour_expired(self, node, src_id):
+        if src_id in node.neighbours:
+            node_ids,src_ids,heard_ticks = self.records["expiries"][1]
+            node_ids.append(node.node_id)
+            src_ids.append(src_id)
+            heard_ticks.append(node.neighbours[src_id])
+
+    def node_transmitted(self, node):
+        self.records["sends"][1][0].append(node.node_id)
+
+    def transmission_received(self, send_node, receivers):
+        sender_ids,receiver_ids = self.records["receives"][1]
+        sender_ids.extend([send_node.node_id]*len(receivers))
+        receiver_ids.extend([node.node_id for node in receivers])
+
+    def half_step_finished(self, engine, step_type):
+        self.collect_route_changes()
+        if step_type == 0:
+            self.flush(self.tick_offset+engine.tick)
+        else:
+            self.flags |= CHUNK_SECOND_HALF
+            self.flush(self.tick_offset+engine.tick-1)
+
+# ---- writing ----
+
+    def collect_route_changes(self):
+        node_ids,dst_ids,next_hops,metrics,seq_numbers = self.records["route_changes"][1]
+        for node in self.engine.nodes:
+            routing_table = node.routing_table
+            if not routing_table.changed_routes:
+                continue
+            routes_dict = routing_table.routes_dict
+            for dst_id in sorted(routing_table.pop_route_changes()):
+                next_hop,metric,seq_num = routes_dict[dst_id][:3]
+                node_ids.append(node.node_id)
+                dst_ids.append(dst_id)
+                next_hops.append(next_hop)
+                metrics.append(metric)
+                seq_numbers.append(seq_num)
+
+    def flush(self, tick):
+        for name,edges in (("edges_added",self.edges_added),("edges_removed",self.edges_removed)):
+            n1_ids,n2_ids = self.records[name][1]
+            for n1_id,n2_id in edges.values():
+                n1_ids.append(n1_id)
+                n2_ids.append(n2_id)
+        counts = [len(int_columns[0]) for float_columns,int_columns in self.records.values()]
+        if not any(counts) and not self.flags:
+            return
+        payload = []
+        for float_columns,int_columns in self.records.values():
+            for column in float_columns+int_columns:
+                data = column.tobytes()
+                payload.append(data)
+                payload.append(bytes(padded(len(data))-len(data)))
+        payload = b"".join(payload)
+
+        self.ticks.append(tick)
+        self.offsets.append(self.file.tell())
+        self.file.write(CHUNK_HEADER.pack(CHUNK_MAGIC,tick,self.flags,len(payload),*counts))
+        self.file.write(payload)
+        self.file.flush()
+        self.last_tick = tick
+        self.clear_records()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.collect_route_changes()
+        self.flush(self.tick_offset+self.engine.tick)
+        self.engine.remove_observer(self)
+        index_offset = self.file.tell()
+        self.file.write(INDEX_HEADER.pack(INDEX_MAGIC,0,len(self.ticks)))
+        self.file.write(array("q",self.ticks).tobytes())
+        self.file.write(array("q",self.offsets).tobytes())
+        self.file.write(TRACE_TRAILER.pack(TRAILER_MAGIC,index_offset))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TraceChunk(object):
+    # one tick of a trace, the columns are zero-copy memoryviews into the
+    # mapped file (np.frombuffer works on them without copying as well)
+    __slots__ = ("tick","flags")+tuple(name for name,num_float,num_int in RECORD_COLUMNS)
+
+    def __init__(self, buffer, offset):
+        magic,self.tick,self.flags,payload_size,*counts = CHUNK_HEADER.unpack_from(buffer,offset)
+        if not magic == CHUNK_MAGIC:
+            raise ValueError("no trace chunk at offset {}".format(offset))
+        position = offset+CHUNK_HEADER.size
+        for (name,num_float,num_int),count in zip(RECORD_COLUMNS,counts):
+            columns = []
+            for typecode,itemsize,num_columns in (("d",8,num_float),("i",4,num_int)):
+                for _ in range(num_columns):
+                    columns.append(buffer[position:position+count*itemsize].cast(typecode))
+                    position += padded(count*itemsize)
+            setattr(self,name,columns)
+
+
+class TraceReader(object):
+    # memory maps a trace, chunks are read on demand so seeking to any tick
+    # costs a binary search over the index and nothing else
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.mmap)
+        magic,version,flags,self.width,self.height = TRACE_HEADER.unpack_from(self.buffer,0)
+        if not magic == TRACE_MAGIC:
+            raise ValueError("{} is not a DSDV trace".format(path))
+        if not version == TRACE_VERSION:
+            raise ValueError("unsupported trace version {}".format(version))
+        if not self.read_index():
+            self.scan_chunks()
+
+    def read_index(self):
+        if len(self.buffer) < TRACE_HEADER.size+TRACE_TRAILER.size:
+            return False
+        magic,index_offset = TRACE_TRAILER.unpack_from(self.buffer,len(self.buffer)-TRACE_TRAILER.size)
+        if not magic == TRAILER_MAGIC:
+            return False
+        magic,_,num_chunks = INDEX_HEADER.unpack_from(self.buffer,index_offset)
+        start = index_offset+INDEX_HEADER.size
+        self.ticks = self.buffer[start:start+8*num_chunks].cast("q").tolist()
+        self.offsets = self.buffer[start+8*num_chunks:start+16*num_chunks].cast("q").tolist()
+        return True
+
+    def scan_chunks(self):
+        # no index (the recorder was not closed): walk the chunk headers and
+        # stop at the first incomplete chunk
+        self.ticks = []
+        self.offsets = []
+        offset = TRACE_HEADER.size
+        while offset+CHUNK_HEADER.size <= len(self.buffer):
+            magic,tick,flags,payload_size = CHUNK_HEADER.unpack_from(self.buffer,offset)[:4]
+            end = offset+CHUNK_HEADER.size+payload_size
+            if not magic == CHUNK_MAGIC or end > len(self.buffer):
+                break
+            self.ticks.append(tick)
+            self.offsets.append(offset)
+            offset = end
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def __getitem__(self, i):
+        return TraceChunk(self.buffer,self.offsets[i])
+
+    def seek(self, tick):
+        # index of the first chunk at or after tick
+        return bisect.bisect_left(self.ticks,tick)
+
+    def get_flags(self, i):
+        return CHUNK_HEADER.unpack_from(self.buffer,self.offsets[i])[2]
+
+    def chunks(self, start_tick=0, end_tick=None):
+        # chunks with start_tick <= tick < end_tick
+        for i in range(self.seek(start_tick),len(self.ticks)):
+            if end_tick is not None and self.ticks[i] >= end_tick:
+                break
+            yield self[i]
+
+    @property
+    def last_tick(self):
+        return self.ticks[-1] if self.ticks else None
+
+    def close(self):
+        self.buffer.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            # chunks still hold views of the mapping, it is unmapped with them
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TraceReplay(object):
+    # plays a trace back into an Engine without simulating: nodes, edges,
+    # neighbours and the recorded routes are set directly and the engine's
+    # observers (e.g. the canvas) see the same callbacks as during the run.
+    # update_step/step/run mirror the engine's half steps, each applies the
+    # changes of its chunk in the order they happen in the engine.
+    def __init__(self, reader, engine):
+        self.reader = reader
+        self.engine = engine
+        self.edges = dict()
+        self.chunk_i = 0
+        self.engine.reset_network()
+
+    def seek(self, tick):
+        # rebuild the state at the start of tick (after all chunks before it)
+        # from the beginning of the trace or the last network reset before it
+        end = self.reader.seek(tick)
+        start = 0
+        for i in range(end-1,-1,-1):
+            chunk = self.reader[i]
+            if chunk.flags & CHUNK_RESET:
+                start = i
+                break
+        self.engine.reset_network()
+        self.edges = dict()
+        for i in range(start,end):
+            self.apply_chunk(self.reader[i],notify=False)
+        self.engine.tick = tick
+        self.engine.update_step_type = 0
+        self.chunk_i = end
+
+    def get_node(self, node_id, cor_x, cor_y):
+        engine = self.engine
+        if node_id < len(engine.nodes):
+            return engine.nodes[node_id]
+        return engine.add_node(cor_x,cor_y,node_id)
+
+    def apply_topology(self, chunk):
+        engine = self.engine
+        if chunk.flags & CHUNK_RESET:
+            engine.reset_network()
+            engine.tick = chunk.tick
+            self.edges = dict()
+        xs,ys,node_ids = chunk.positions
+        moved = False
+        for node_id,cor_x,cor_y in zip(node_ids,xs,ys):
+            if node_id < len(engine.nodes):
+                node = engine.nodes[node_id]
+                node.cor_x,node.cor_y = cor_x,cor_y
+                engine.spatial_grid.move(node)
+                moved = True
+                for observer in engine.observers:
+                    observer.node_moved(node)
+            else:
+                engine.add_node(cor_x,cor_y,node_id)
+        if moved:
+            engine.topology_version += 1
+        for n1_id,n2_id in zip(*chunk.edges_removed):
+            engine.remove_edge(self.edges.pop(get_edge_key(n1_id,n2_id)))
+        for n1_id,n2_id in zip(*chunk.edges_added):
+            self.edges[get_edge_key(n1_id,n2_id)] = engine.add_edge(engine.nodes[n1_id],engine.nodes[n2_id])
+
+    def apply_expiries(self, chunk):
+        nodes = self.engine.nodes
+        for node_id,src_id,heard_tick in zip(*chunk.expiries):
+            nodes[node_id].neighbours[src_id] = heard_tick
+
+    def apply_sends(self, chunk):
+        nodes = self.engine.nodes
+        for observer in self.engine.observers:
+            for node_id in chunk.sends[0]:
+                observer.node_transmitted(nodes[node_id])
+
+    def apply_receives(self, chunk, notify=True):
+        nodes = self.engine.nodes
+        sender_ids,receiver_ids = chunk.receives
+        for sender_id,receiver_id in zip(sender_ids,receiver_ids):
+            nodes[receiver_id].neighbours[sender_id] = chunk.tick
+        if notify:
+            for observer in self.engine.observers:
+                for sender_id in dict.fromkeys(sender_ids):
+                    observer.transmission_delivered(nodes[sender_id])
+
+    def apply_route_changes(self, chunk):
+        nodes = self.engine.nodes
+        for node_id,dst_id,next_hop,metric,seq_num in zip(*chunk.route_changes):
+            nodes[node_id].routing_table.set_route(dst_id,next_hop,metric,seq_num,chunk.tick)
+
+    def apply_chunk(self, chunk, notify=True):
+        if chunk.flags & CHUNK_SECOND_HALF:
+            # receives, then the mobility step at the end of the tick
+            if notify:
+                self.apply_sends(chunk)
+            self.apply_receives(chunk,notify)
+            self.apply_route_changes(chunk)
+            self.apply_topology(chunk)
+            self.apply_expiries(chunk)
+        else:
+            # changes since the last tick, then neighbour checks and sends
+            self.apply_topology(chunk)
+            self.apply_expiries(chunk)
+            if notify:
+                self.apply_sends(chunk)
+            self.apply_receives(chunk,notify)
+            self.apply_route_changes(chunk)
+
+    def update_step(self):
+        engine = self.engine
+        step_type = engine.update_step_type
+        reader = self.reader
+        if self.chunk_i < len(reader) and reader.ticks[self.chunk_i] == engine.tick:
+            if bool(reader.get_flags(self.chunk_i) & CHUNK_SECOND_HALF) == (step_type == 1):
+                self.apply_chunk(reader[self.chunk_i])
+                self.chunk_i += 1
+        if step_type == 0:
+            engine.update_step_type = 1
+        else:
+            engine.tick += 1
+            engine.update_step_type = 0
+        for observer in engine.observers:
+            observer.half_step_finished(engine, step_type)
+
+    def step(self):
+        self.update_step()
+        while self.engine.update_step_type != 0:
+            self.update_step()
+
+    def run(self, ticks):
+        for _ in range(ticks):
+            self.step()
+
+    def is_finished(self):
+        return self.chunk_i >= len(self.reader)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="summary of a DSDV trace file")
+    parser.add_argument("trace")
+    args = parser.parse_args()
+
+    with TraceReader(args.trace) as reader:
+        totals = dict.fromkeys((name for name,num_float,num_int in RECORD_COLUMNS),0)
+        for chunk in reader.chunks():
+            for name in totals:
+                totals[name] += len(getattr(chunk,name)[-1])
+        print("{} chunks, ticks {} to {}, area {}x{}".format(len(reader),reader.ticks[0] if reader.ticks else None,reader.last_tick,reader.width,reader.height))
+        print(", ".join("{} {}".format(count,name.replace("_"," ")) for name,count in totals.items()))
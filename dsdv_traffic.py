@@ -0,0 +1,257 @@
+import argparse
+import json
+import math
+import random
+from collections import deque
+
+from dsdv_engine import EngineObserver, create_engine, add_engine_arguments, get_engine_kwargs
+from dsdv_metrics import Histogram
+from dsdv_routing import INVALID_METRIC
+
+# Data plane on top of the simulated DSDV control plane. Flows inject
+# packets at their source, once per tick (after the tick's deliveries) every
+# node forwards up to packets_per_tick packets from the head of its queue to
+# the next_hop of its routing table, one hop per tick. A packet is dropped
+# when its node has no valid route ("no_route"), the next hop is out of
+# range ("link_broken"), the next queue is full ("queue_full") or it made
+# max_hops hops, e.g. in a forwarding loop ("ttl"). Data packets do not go
+# through the medium and do not disturb the control plane, the traffic has
+# its own random stream.
+
+FLOW_KINDS = ("cbr","poisson")
+DROP_REASONS = ("no_route","link_broken","queue_full","ttl")
+
+class Flow(object):
+    # rate: packets per tick, "cbr": evenly spaced, "poisson": a Poisson
+    # number of packets per tick. Active from start_tick until before stop_tick
+    def __init__(self, src_id, dst_id, rate, kind="cbr", start_tick=0, stop_tick=None):
+        if kind not in FLOW_KINDS:
+            raise ValueError("unknown flow kind {!r}, expected one of {}".format(kind,FLOW_KINDS))
+        if src_id == dst_id:
+            raise ValueError("flow from node {} to itself".format(src_id))
+        self.src_id = src_id
+        self.dst_id = dst_id
+        self.rate = rate
+        self.kind = kind
+        self.start_tick = start_tick
+        self.stop_tick = stop_tick
+        self.reset()
+
+    def reset(self):
+        self.credit = 1.0
+        self.generated = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.latency_total = 0
+        self.hops_total = 0
+
+    def is_active(self, tick):
+        return self.start_tick <= tick and (self.stop_tick is None or tick < self.stop_tick)
+
+    def get_packet_count(self, rng):
+        if self.kind == "cbr":
+            count = int(self.credit)
+            self.credit += self.rate-count
+            return count
+        # Knuth's method, fine for the small rates of a single flow
+        limit = math.exp(-self.rate)
+        count = 0
+        product = rng.random()
+        while product > limit:
+            count += 1
+            product *= rng.random()
+        return count
+
+    def to_dict(self):
+        return {"src_id": self.src_id, "dst_id": self.dst_id, "rate": self.rate, "kind": self.kind,
+                "generated": self.generated, "delivered": self.delivered, "dropped": self.dropped,
+                "delivery_ratio": self.delivered/self.generated if self.generated else None,
+                "mean_latency": self.latency_total/self.delivered if self.delivered else None,
+                "mean_hops": self.hops_total/self.delivered if self.delivered else None}
+
+
+class DataPacket(object):
+    __slots__ = ("flow","created_tick","hops")
+
+    def __init__(self, flow, created_tick):
+        self.flow = flow
+        self.created_tick = created_tick
+        self.hops = 0
+
+
+def random_flows(engine, num_flows, rate, kind="cbr", rng=random, start_tick=0, stop_tick=None):
+    node_ids = [node.node_id for node in engine.nodes]
+    flows = []
+    for _ in range(num_flows):
+        src_id,dst_id = rng.sample(node_ids,2)
+        flows.append(Flow(src_id,dst_id,rate,kind,start_tick,stop_tick))
+    return flows
+
+
+class TrafficGenerator(EngineObserver):
+    def __init__(self, engine, flows=(), packets_per_tick=1, queue_capacity=50, max_hops=64, packet_size=512, seed=None):
+        self.engine = engine
+        self.flows = list(flows)
+        self.packets_per_tick = packets_per_tick
+        self.queue_capacity = queue_capacity
+        self.max_hops = max_hops
+        # bytes, for the throughput only
+        self.packet_size = packet_size
+        self.rng = random.Random(seed)
+        self.nodes_by_id = dict()
+        self.nodes_version = None
+        self.reset()
+        engine.add_observer(self)
+
+    def reset(self):
+        # node_id -> queue, only nodes with queued packets
+        self.queues = dict()
+        # ticks since the first flow started, the warmup does not count
+        # towards the throughput
+        self.ticks = 0
+        self.generated = 0
+        self.delivered = 0
+        self.dropped = dict.fromkeys(DROP_REASONS,0)
+        self.latencies = Histogram()
+        self.hop_counts = Histogram()
+        for flow in self.flows:
+            flow.reset()
+
+    def add_flow(self, flow):
+        self.flows.append(flow)
+
+    def network_reset(self, engine):
+        self.reset()
+
+    def half_step_finished(self, engine, step_type):
+        if step_type == 1:
+            self.step(engine.tick-1)
+
+    def get_nodes_by_id(self):
+        engine = self.engine
+        if not self.nodes_version == engine.topology_version:
+            self.nodes_by_id = {node.node_id: node for node in engine.nodes}
+            self.nodes_version = engine.topology_version
+        return self.nodes_by_id
+
+    def step(self, tick):
+        for flow in self.flows:
+            if flow.is_active(tick):
+                for _ in range(flow.get_packet_count(self.rng)):
+                    flow.generated += 1
+                    self.generated += 1
+                    self.enqueue(flow.src_id,DataPacket(flow,tick))
+        self.forward(tick)
+        if self.flows and tick >= min(flow.start_tick for flow in self.flows):
+            self.ticks += 1
+
+    def enqueue(self, node_id, packet):
+        queue = self.queues.get(node_id)
+        if queue is None:
+            queue = self.queues[node_id] = deque()
+        if len(queue) >= self.queue_capacity:
+            self.drop(packet,"queue_full")
+            return
+        queue.append(packet)
+
+    def drop(self, packet, reason):
+        self.dropped[reason] += 1
+        packet.flow.dropped += 1
+
+    def forward(self, tick):
+        nodes_by_id = self.get_nodes_by_id()
+        # forwarded packets are queued at their next hop after every node
+        # had its turn, one hop per tick
+        arrivals = []
+        for node_id in list(self.queues.keys()):
+            queue = self.queues[node_id]
+            node = nodes_by_id[node_id]
+            routes = node.routing_table.routes_dict
+            for _ in range(min(self.packets_per_tick,len(queue))):
+                packet = queue.popleft()
+                dst_id = packet.flow.dst_id
+                route = routes.get(dst_id)
+                if route is None or route[1] >= INVALID_METRIC:
+                    self.drop(packet,"no_route")
+                    continue
+                next_hop = nodes_by_id.get(route[0])
+                if next_hop is None or node.get_distance((next_hop.cor_x,next_hop.cor_y)) > node.tx_range:
+                    self.drop(packet,"link_broken")
+                    continue
+                packet.hops += 1
+                if next_hop.node_id == dst_id:
+                    self.deliver(packet,tick)
+                elif packet.hops >= self.max_hops:
+                    self.drop(packet,"ttl")
+                else:
+                    arrivals.append((next_hop.node_id,packet))
+            if not queue:
+                del self.queues[node_id]
+        for node_id,packet in arrivals:
+            self.enqueue(node_id,packet)
+
+    def deliver(self, packet, tick):
+        # latency in ticks, a packet sent straight to its destination in
+        # the tick it was generated in has latency 1
+        latency = tick-packet.created_tick+1
+        self.delivered += 1
+        self.latencies.add(latency)
+        self.hop_counts.add(packet.hops)
+        flow = packet.flow
+        flow.delivered += 1
+        flow.latency_total += latency
+        flow.hops_total += packet.hops
+
+# ---- report ----
+
+    def get_in_flight(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def get_report(self):
+        ticks = max(self.ticks,1)
+        return {"ticks": self.ticks, "flows": len(self.flows), "generated": self.generated, "delivered": self.delivered,
+                "dropped": dict(self.dropped), "in_flight": self.get_in_flight(),
+                "delivery_ratio": self.delivered/self.generated if self.generated else None,
+                "throughput_packets": self.delivered/ticks, "throughput_bytes": self.delivered*self.packet_size/ticks,
+                "mean_latency": self.latencies.mean() if self.delivered else None,
+                "mean_hops": self.hop_counts.mean() if self.delivered else None,
+                "latency_histogram": self.latencies.to_dict(), "hops_histogram": self.hop_counts.to_dict(),
+                "per_flow": [flow.to_dict() for flow in self.flows]}
+
+    def summary(self):
+        report = self.get_report()
+        lines = ["{flows} flows: {generated} packets generated, {delivered} delivered, {in_flight} in flight".format(**report)]
+        if report["delivery_ratio"] is not None:
+            lines.append("delivery ratio {:.4f}, throughput {:.3f} packets/tick ({:.0f} bytes/tick)".format(report["delivery_ratio"],report["throughput_packets"],report["throughput_bytes"]))
+        if report["mean_latency"] is not None:
+            lines.append("mean latency {:.2f} ticks, mean hop count {:.2f}".format(report["mean_latency"],report["mean_hops"]))
+        lines.append("dropped: "+", ".join("{} {}".format(count,reason) for reason,count in report["dropped"].items()))
+        return "\n".join(lines)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DSDV simulation with data traffic")
+    parser.add_argument("--nodes", type=int, default=100)
+    parser.add_argument("--ticks", type=int, default=200, help="ticks with traffic")
+    parser.add_argument("--warmup", type=int, default=50, help="ticks for the routes to form before the flows start")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--flows", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=0.2, help="packets per tick and flow")
+    parser.add_argument("--traffic", choices=FLOW_KINDS, default="cbr")
+    parser.add_argument("--packets-per-tick", type=int, default=1, help="forwarding capacity of a node")
+    parser.add_argument("--queue-capacity", type=int, default=50)
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    add_engine_arguments(parser)
+    args = parser.parse_args()
+
+    engine = create_engine(args.width,args.height,seed=args.seed,**get_engine_kwargs(args))
+    engine.initialise_network(args.nodes)
+    traffic = TrafficGenerator(engine,packets_per_tick=args.packets_per_tick,queue_capacity=args.queue_capacity,seed=args.seed)
+    for flow in random_flows(engine,args.flows,args.rate,args.traffic,traffic.rng,start_tick=args.warmup):
+        traffic.add_flow(flow)
+    engine.run(args.warmup+args.ticks)
+    print(traffic.summary())
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(traffic.get_report(), f, indent=1)